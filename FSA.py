@@ -1,12 +1,41 @@
 
+import time
+
+# When this module started loading, for the startup time the CLI reports.
+_loadStart = time.perf_counter()
+
+import array
+import bisect
+import contextlib
 import dataclasses
+import hashlib
+import io
+import json
+import os
 import re
 import string
 import sys
+import threading
 import typing
 import weakref
 
-import pyperclip
+# numpy is imported by require_numpy on first use, it is slow to import and
+# only the compiled simulation needs it.
+np = None
+
+
+def require_numpy():
+    """
+    :return: The numpy module, imported on first use.
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError as e:
+            raise ImportError("This needs numpy (pip install numpy).") from e
+        np = numpy
+    return np
 
 # TO start thinking about
 #
@@ -70,12 +99,21 @@ class State:
     idx: int | str
 
     @classmethod
-    def sort_list(cls, states: list[str]) -> list[str]:
-        return [str(q) for q in sorted([State.from_string(s_q) for s_q in states])]
+    def sort_list(cls, states: typing.Iterable[str]) -> list[str]:
+        # Interned states are only parsed the first time they are seen, and
+        # their sort keys are computed when they are interned.
+        prof = PROFILER
+        if prof is not None:
+            start = prof.begin()
+        names = [STATES.name(sid) for sid in sorted(map(STATES.parse, states), key=STATES.keys.__getitem__)]
+        if prof is not None:
+            prof.end('sort_list', start)
+        return names
+
     @classmethod
     def from_string(cls, s: str) -> 'State':
         # return f"{preprefix}q^{Brace(self.prefix)}_{Brace(str(self.idx))}{postfix}"
-        mtch = re.match(r"\s?q\^\{([\w, \\]+)\}_\{(\w)\}\s?",s)
+        mtch = _stateRe.fullmatch(s)
         if not mtch:
             raise ValueError(f"The state '{s}' does not seem to match the standard formatting.")
         return State(mtch.group(1), mtch.group(2))
@@ -101,17 +139,201 @@ class State:
         return f"{preprefix}q^{Brace(self.prefix)}_{Brace(str(self.idx))}{postfix}"
 
     def __lt__(self, other: 'State') -> bool:
-        # Final states are gt all other states.
-        match (self.idx, other.idx):
-            case ('f', 'f'):
-                return self.prefix > other.prefix
-            case ('f', _):
-                return False
-            case (_, 'f'):
-                return True
-            case _:
-                return self.prefix < other.prefix
-        # return self.prefix + '.' + str(self.idx) < other.prefix + '.' + str(other.idx)
+        return state_key(self.prefix, self.idx) < state_key(other.prefix, other.idx)
+
+
+_stateRe = re.compile(r"\s?q\^\{([^{}]*)\}_\{([^{}]+)\}\s?")
+
+
+def norm_idx(idx: int | str) -> int | str:
+    """
+    Normalizes a state index so that 1 and '1' name the same state.
+    :param idx: The index of a state in a FSA machine.
+    :return: The index as an int when it is a plain number, otherwise unchanged.
+    """
+    if isinstance(idx, str) and idx.isdigit() and str(int(idx)) == idx:
+        return int(idx)
+    return idx
+
+
+stateKeyType = tuple[bool, bool, tuple[int, ...], int, int, str]
+
+
+def state_key(prefix: str | None, idx: int | str) -> stateKeyType:
+    """
+    The key states are sorted by. It is a total order: final states are gt all
+    other states and are ordered by prefix in reverse (so a composed machine's
+    own q_f is last), other states are ordered by prefix. States with the same
+    prefix are ordered by idx, numbered states (in numeric order) before named
+    ones (in alphabetical order). States that are not in the standard format
+    (no prefix) come after the others of their kind.
+    :param prefix: FSA's prefix, None for a state not in the standard format.
+    :param idx: The index of the state in the FSA machine.
+    :return: A tuple that compares as the state does.
+    """
+    idx = norm_idx(idx)
+    final = idx == 'f'
+    # Negated code points, closed by an element that is gt all of them, sort
+    # strings in reverse.
+    prefixKey = tuple([-ord(c) for c in prefix or ''] + [1] if final else map(ord, prefix or ''))
+    if isinstance(idx, int):
+        return final, prefix is None, prefixKey, 0, idx, ''
+    return final, prefix is None, prefixKey, 1, 0, idx
+
+
+class StateTable:
+    """
+    Interns states as small integer ids. Machines hash, compare and index these
+    ids instead of the LaTeX names; a name is only built (then cached) when a
+    state is rendered. The per state data lives in parallel arrays indexed by id.
+
+    States given as strings that are not in the standard format are kept as
+    opaque states with no prefix whose name is the string itself.
+
+    The sort key of every state (see state_key) is computed once, when it is
+    interned, so sorting states never parses or compares names.
+
+    Ids are never released one by one; see reset_interning for emptying the table.
+    """
+    __slots__ = ('prefixes', 'idxs', 'keys', 'generation', '_names', '_ids', '_parsed', '_lock')
+
+    def __init__(self):
+        # Counts the times the table was emptied, ids only mean something
+        # within one generation.
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets every state and starts a new generation.
+        """
+        self.prefixes: list[str | None] = []
+        self.idxs: list[int | str] = []
+        self.keys: list[stateKeyType] = []
+        self._names: list[str | None] = []
+        self._ids: dict[tuple[str | None, int | str], int] = dict()
+        self._parsed: dict[str, int] = dict()
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self.idxs)
+
+    def intern(self, prefix: str | None, idx: int | str) -> int:
+        """
+        :param prefix: FSA's prefix (already converted with idx_2).
+        :param idx: The index of this state in the FSA machine.
+        :return: The id of the state, allocating one on first use.
+        """
+        key = (prefix, norm_idx(idx))
+        sid = self._ids.get(key)
+        if sid is None:
+            with self._lock:
+                sid = self._ids.get(key)
+                if sid is None:
+                    sid = len(self.idxs)
+                    idx = key[1]
+                    self.prefixes.append(prefix)
+                    self.idxs.append(idx)
+                    self.keys.append(state_key(prefix, idx))
+                    self._names.append(None)
+                    # Publish last so other threads never see a half built entry.
+                    self._ids[key] = sid
+        return sid
+
+    def parse(self, s: str) -> int:
+        """
+        :param s: A state name as produced by state() (surrounding spaces ignored).
+        :return: The id of the state.
+        """
+        sid = self._parsed.get(s)
+        if sid is None:
+            mtch = _stateRe.fullmatch(s)
+            if mtch:
+                sid = self.intern(mtch.group(1), mtch.group(2))
+            else:
+                sid = self.intern(None, s)
+            self._parsed[s] = sid
+        return sid
+
+    def state(self, sid: int) -> State:
+        prefix = self.prefixes[sid]
+        return State(prefix if prefix is not None else '', self.idxs[sid])
+
+    def name(self, sid: int) -> str:
+        """
+        :return: The LaTeX name of the state, formatted as in State.__str__.
+        """
+        nm = self._names[sid]
+        if nm is None:
+            if self.prefixes[sid] is None:
+                nm = str(self.idxs[sid])
+            else:
+                nm = str(self.state(sid))
+            self._names[sid] = nm
+        return nm
+
+
+class SymbolTable:
+    """
+    Interns transition labels as small integer ids. A label that lists several
+    elements ('b, c') has its own id, and parts maps every label id to the ids of
+    the single elements it stands for.
+    """
+    __slots__ = ('names', 'parts', '_ids', '_lock')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets every label.
+        """
+        self.names: list[str] = []
+        self.parts: list[tuple[int, ...]] = []
+        self._ids: dict[str, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, on: 'onType') -> int:
+        label = on if isinstance(on, str) else ', '.join(on)
+        lid = self._ids.get(label)
+        if lid is None:
+            with self._lock:
+                lid = self._ids.get(label)
+                if lid is None:
+                    eles = [ele.strip() for ele in label.split(',')]
+                    parts = (tuple(self.intern(ele) for ele in eles) if len(eles) > 1 else None)
+                    lid = len(self.names)
+                    self.names.append(label)
+                    self.parts.append(parts if parts is not None else (lid,))
+                    self._ids[label] = lid
+        return lid
+
+
+STATES = StateTable()
+SYMBOLS = SymbolTable()
+
+EPS = SYMBOLS.intern(eps_ele)
+
+
+def reset_interning():
+    """
+    Empties STATES and SYMBOLS. Interned states and labels are otherwise kept for
+    the life of the process, so a long running process that builds many unrelated
+    machines should call this between batches to release them.
+    Machines and regular expressions notice the reset and build their automata
+    again on next use. Automata, simulations and ids held anywhere else belong to
+    the old tables and must not be used afterwards. It must not be called while
+    other threads are using machines.
+    """
+    with STATES._lock, SYMBOLS._lock:
+        STATES.clear()
+        SYMBOLS.clear()
+        # ε keeps its id, EPS is used everywhere.
+        SYMBOLS.intern(eps_ele)
 
 def state(prefix: str, idx: int | str) -> str:
     """
@@ -171,6 +393,33 @@ longMachTemplate: string.Template = (
 onType = str | typing.Iterable[str]
 
 
+def split_template(template: string.Template, placeholder: str) -> tuple[string.Template, string.Template]:
+    """
+    Splits a template around one of its placeholders so that the text either side
+    can be substituted on its own and the placeholder's content streamed between.
+    :param template: The template.
+    :param placeholder: The name of the placeholder, without the $.
+    :return: The templates before and after the placeholder.
+    """
+    head, _, tail = template.template.partition('$' + placeholder)
+    return string.Template(head), string.Template(tail)
+
+tableTemplate: string.Template = (
+        string.Template(
+                """\\end{gather*}
+$$$$
+\\begin{array}{|$colDec}
+    \\hline
+    \\delta_{$prefix} & \\; &  $eles  \\\\ \\hline
+    $rows \\\\ \\hline
+\\end{array}
+$$$$
+\\begin{gather*}
+    """))
+
+tableHead, tableTail = split_template(tableTemplate, 'rows')
+
+
 @dataclasses.dataclass
 class Delta:
     fromState: str
@@ -189,65 +438,19 @@ class Delta:
         # q_{0-1} & \; & q_{e} &  q_{ne}\\ \hline
         # \ACC q_{e} & \; & q_{e} & q_{ne}\\ \hline
         # q_{ne} & \; & q_{e} & q_{ne}\\
-        tableTemplate = string.Template(
-                """\\end{gather*}
-$$$$
-\\begin{array}{|$colDec}
-    \\hline
-    \\delta_{$prefix} & \\; &  $eles  \\\\ \\hline
-    $rows \\\\ \\hline
-\\end{array}
-$$$$
-\\begin{gather*}
-    """)
-        sigma = set()
-        states = set()
-        fromToMap: dict[str, dict[str, list[str]|str]] = dict()
-        # Add all element in the current alphabet to the list of elements.
-        # Add all states to state list.
-        for delta in deltaTable:
-            if isinstance(delta.on, str):
-                sigma.add(delta.on)
-            else:
-                sigma.update(delta.on)
-
-            fromToMap[norm_st(delta.fromState)] = {'ORIG': delta.fromState}
-            states.add(delta.fromState)
-            states.add(delta.toState)
-
-        # For states that are accepting they may not appear in the mapping.
-        # This is used as a default empty mapping. This will ALWAYS happen in
-        # an FSA constructed by Thompson's Construction Algorithm.
-        blankKey: dict[str, list[str]] = dict([(ele, list()) for ele in sigma])
-        # Could have done this all at once, but not concerned with speed, and
-        # I believe there is some issue with set default and nested collections.
-        for state in states:
-            # Must do this before sorting because State.sort_list destroys
-            # normalization.
-            fromToMap.setdefault(norm_st(state), dict())['ORIG'] = state
-            for ele in sigma:
-                fromToMap[norm_st(state)][ele] = list()
+        prof = PROFILER
+        if prof is not None:
+            start = prof.begin()
+        auto = Automaton(prefix)
         for delta in deltaTable:
-            if isinstance(delta.on, str):
-                fromToMap[norm_st(delta.fromState)][delta.on].append(delta.toState)
-            else:
-                for ele in delta.on:
-                    fromToMap[norm_st(delta.fromState)][ele].append(delta.toState)
-
-        sigma = sorted(list(sigma))
-        states = State.sort_list(states)
-        accepting = lambda state: '\\ACC ' if state[-1] == ' ' else ''
-        return tableTemplate.substitute(
-                prefix=prefix,
-                colDec='|'.join(list((len(sigma) + 3) * 'c')),
-                eles=' & '.join(list(sigma)),
-                rows='\\\\ \\hline\n  '.join(
-                        [accepting(fromToMap[norm_st(state)]['ORIG']) + state + " & \\; & " + " & ".join(
-                                [', '.join(fromToMap[norm_st(state)][ele]) for ele in sigma])
-                         for state in states]))
+            auto.add(STATES.parse(delta.fromState), SYMBOLS.intern(delta.on), STATES.parse(delta.toState))
+        table = auto.to_table()
+        if prof is not None:
+            prof.end('deltas_to_table', start)
+        return table
 
 
-transitions_type = (list[tuple[int | str, onType, int | str] | Delta] | onType)
+transitions_type = (list[tuple[int | str, onType, int | str] | Delta] | onType | 'Thompson' | 'Regex')
 
 TRIM_COMPOSED_ACC_STATES = True
 norm_st = lambda state: state
@@ -259,78 +462,2371 @@ if TRIM_COMPOSED_ACC_STATES:
 
 state_2norm = lambda *state: norm_st(state_2(*state))
 
-@dataclasses.dataclass
-class Machine:
-    name: str
-    transitions: transitions_type
+# The δ table has a column per transition label, as written ('b, c' is one
+# column). When this is set the labels are split into their elements instead,
+# and the elements whose columns are identical (an equivalence class of the
+# alphabet, like b and c in mt6M) are rendered as one column headed 'b, c'.
+MERGE_EQUIVALENT_COLUMNS = False
+
+# The δ table is rendered in pieces of this many rows, so a long machine can be
+# written out without building the whole table as one string.
+TABLE_CHUNK_ROWS = 1024
+
+# The passes (Automaton -> Automaton, such as SIMPLIFY_PASSES) getMachine runs
+# a machine through before choosing its template, unless it is given others.
+RENDER_PASSES: typing.Sequence[typing.Callable[['Automaton'], 'Automaton']] = ()
 
-    def to_mermaid(self) -> str:
-        deltas = []
-        states = set()
-        for delta in self.__normalize().transitions:
-            deltas.append((State.from_string(delta.fromState), delta.on, State.from_string(delta.toState)))
-            states.add(delta.fromState)
-            states.add(delta.toState)
-        qStates = [State.from_string(sq) for sq in states]
-        nodes = '\n'.join([f'  q{q.idx}(("$$q_{q.idx}$$"))' for q in qStates])
-        return f"""
-flowchart LR
-    {nodes}
+# The Profiler the render pipeline reports its stages to, None (the default)
+# when nothing is being profiled. Set by entering a Profiler.
+PROFILER: 'Profiler | None' = None
+
+# Called with (machine, stage, seconds, keptBlocks) each time a stage finishes.
+profileCallbackType = typing.Callable[[str, str, float, int], typing.Any]
+
+
+class Profiler:
+    """
+    Records where rendering spends its time: for every machine and every stage
+    of the pipeline, how many times the stage ran, the wall time it took and
+    keptBlocks, the change in sys.getallocatedblocks over the stage. That is the
+    number of memory blocks the stage left allocated, net of those it freed. It
+    is not a count of allocations: a stage that allocates and frees a million
+    blocks keeps none, and one that frees more than it keeps is negative. The
+    stages are
+        normalize        flattening the transitions into an automaton and
+                         running the render passes on it (build_automaton),
+        deltas           the machine's Delta transitions, returned with the
+                         LaTeX,
+        states           collecting the state names and the start and accepting
+                         states for the template,
+        sort_list        sorting the states (State.sort_list),
+        deltas_to_table  the δ table (Delta.deltas_to_table, or its rows as
+                         they are rendered),
+        substitute       the string.Template substitutions.
+    While no Profiler is entered PROFILER is None, and all a stage costs is
+    checking that.
+    Examples:
+        with Profiler() as prof:
+            print_mach('a', 'a')
+        print(prof.to_json())
+    """
+    STAGES = ('normalize', 'deltas', 'states', 'sort_list', 'deltas_to_table', 'substitute')
+    # Where stages run before any machine is rendered are recorded.
+    NO_MACHINE = ''
+
+    def __init__(self, callback: profileCallbackType | None = None, keptBlocks: bool = True):
         """
+        :param callback: Also called every time a stage finishes.
+        :param keptBlocks: Whether to measure the blocks each stage keeps (0 if not).
+        """
+        self.callback = callback
+        self.keptBlocks = keptBlocks
+        # machine -> stage -> [calls, seconds, keptBlocks]
+        self.stats: dict[str, dict[str, list]] = dict()
+        # The machine last rendered, for the stages that don't know theirs.
+        self.machine = self.NO_MACHINE
+        self._lock = threading.Lock()
+        self._previous: list['Profiler | None'] = []
+
+    def __enter__(self) -> 'Profiler':
+        global PROFILER
+        self._previous.append(PROFILER)
+        PROFILER = self
+        return self
 
-    def __str__(self) -> str:
-        return getMachineStr(self.name, self.transitions)
-    def __normalize(self) -> 'Machine':
+    def __exit__(self, *exc):
+        global PROFILER
+        PROFILER = self._previous.pop()
+
+    def begin(self) -> tuple[float, int]:
         """
-        This returns a new machine with all the same transitions as this machine,
-        but with all transitions as Delta instances.
-        :see: Delta
-        :return: A new machine identical to this one.
+        :return: What end needs to measure the stage starting now.
         """
-        global TRIM_COMPOSED_ACC_STATES
+        return time.perf_counter(), sys.getallocatedblocks() if self.keptBlocks else 0
 
-        deltasTable: list[Delta] = []
-        prefix = idx_2(self.name)
-        match self.transitions:
+    def end(self, stage: str, start: tuple[float, int], machine: str | None = None):
+        """
+        Records a stage.
+        :param start: What begin returned when the stage started.
+        :param machine: The machine's name, by default the one being rendered.
+        """
+        self._record(self.machine if machine is None else machine, stage, time.perf_counter() - start[0],
+                     sys.getallocatedblocks() - start[1] if self.keptBlocks else 0)
+
+    def _record(self, machine: str, stage: str, seconds: float, keptBlocks: int):
+        with self._lock:
+            entry = self.stats.setdefault(machine, dict()).setdefault(stage, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += keptBlocks
+        if self.callback is not None:
+            self.callback(machine, stage, seconds, keptBlocks)
+
+    def timed(self, stage: str, pieces: typing.Iterator[str], machine: str | None = None) -> typing.Iterator[str]:
+        """
+        Records a stage that produces its output in pieces, without the time
+        spent by whoever consumes them.
+        :return: The same pieces.
+        """
+        machine = self.machine if machine is None else machine
+        seconds = 0.0
+        kept = 0
+        while True:
+            start = self.begin()
+            piece = next(pieces, None)
+            seconds += time.perf_counter() - start[0]
+            if self.keptBlocks:
+                kept += sys.getallocatedblocks() - start[1]
+            if piece is None:
+                break
+            yield piece
+        self._record(machine, stage, seconds, kept)
+
+    def summary(self) -> dict:
+        """
+        :return: {'machines': {machine: {stage: {'calls', 'seconds', 'keptBlocks'}}},
+            'stages': the same for every stage over all the machines}
+        """
+        with self._lock:
+            machines = {machine: {stage: dict(calls=calls, seconds=seconds, keptBlocks=keptBlocks)
+                                  for stage, (calls, seconds, keptBlocks) in stages.items()}
+                        for machine, stages in self.stats.items()}
+        totals = dict()
+        for stages in machines.values():
+            for stage, entry in stages.items():
+                total = totals.setdefault(stage, dict(calls=0, seconds=0.0, keptBlocks=0))
+                for field in total:
+                    total[field] += entry[field]
+        return dict(machines=machines, stages=totals)
+
+    def to_json(self, out: typing.TextIO | str | os.PathLike | None = None) -> str | None:
+        """
+        :param out: A file (or its path) to write the summary to.
+        :return: The summary as JSON, if there is no out.
+        """
+        match out:
+            case None:
+                return json.dumps(self.summary(), indent=1)
+            case str() | os.PathLike():
+                with open(out, 'w') as dst:
+                    json.dump(self.summary(), dst, indent=1)
+            case _:
+                json.dump(self.summary(), out, indent=1)
+
+acceptingType = typing.Iterable[int | str]
+
+
+def state_id(prefix: str, possIdx: int | str) -> int:
+    """
+    Interns a state as written in a transition list.
+    :param prefix: The prefix of the machine the transition list belongs to.
+    :param possIdx: 0, 'f' or an int index of a state of that machine, or an
+        already fully formatted state.
+    :return: The id of the state.
+    """
+    match possIdx:
+        case '0' | 'f' | int(_):
+            # Add my prefix and create a state.
+            return STATES.intern(prefix, possIdx)
+        case str():
+            # This is already a fully formatted state.
+            return STATES.parse(possIdx)
+        case _:
+            raise ValueError(f"Unrecognized transition element {possIdx}")
+
+
+class Automaton:
+    """
+    The compact form of a machine that everything else works on. States are ids
+    from STATES, transition labels are ids from SYMBOLS and δ is held as three
+    parallel arrays (src, lab, dst), one entry per transition. LaTeX strings are
+    only produced by the to_* methods.
+
+    For editing (add, remove, rename) some views are built on first use and then
+    kept up to date rather than rebuilt: the positions of the transitions
+    touching each state, the position of each state, the number of transitions
+    using each label, the sorted states, Σ, the Delta list and the rendered δ
+    table rows and lines (in the order of the sorted states). An edit only looks
+    at the transitions of the states it touches and only renders their rows
+    again (all of them when Σ changes). Removing a transition or a state moves
+    the last one into its place. The sorted states and their lines are lists, so
+    keeping them sorted shifts them, and rendering still joins every line.
+    """
+    __slots__ = ('prefix', 'finals', 'marked', 'states', 'src', 'lab', 'dst', 'generation', '_seen', '_sim', '_index',
+                 '_at', '_statePos', '_labCount', '_sorted', '_sortedNames', '_labels', '_deltas', '_rows',
+                 '_lines', '_stale', '_lineFinals')
+
+    def __init__(self, prefix: str, finals: typing.Iterable[int] | None = None):
+        """
+        :param prefix: The machine's prefix (its name converted with idx_2).
+        :param finals: The accepting states, by default just q_f.
+        """
+        self.prefix = prefix
+        # The generation of STATES the ids belong to, see reset_interning.
+        self.generation = STATES.generation
+        self.finals: list[int] = list(finals) if finals is not None else [self.final]
+        # States written as accepting in a transition list (see mark), their δ
+        # rows get \ACC like the accepting states'.
+        self.marked: set[int] = set()
+        # States in the order they were first seen.
+        self.states = array.array('l')
+        self.src = array.array('l')
+        self.lab = array.array('l')
+        self.dst = array.array('l')
+        self._seen: set[int] = set()
+        self._sim: Simulation | None = None
+        self._index: TransitionIndex | None = None
+        self._forget()
+
+    def _forget(self):
+        # Drops every view, they are built again on first use.
+        self._sim = self._index = None
+        # The positions of the transitions from or to each state (in order), and
+        # the position of each state in states.
+        self._at: dict[int, list[int]] | None = None
+        self._statePos: dict[int, int] | None = None
+        self._labCount: dict[int, int] | None = None
+        self._sorted: list[int] | None = None
+        self._sortedNames: list[str] | None = None
+        self._labels: list[int] | None = None
+        self._deltas: list[Delta] | None = None
+        # The rendered cells of each state's δ row, for the current labels.
+        self._rows: dict[int, str] = dict()
+        # The δ table lines of the sorted states, the states whose line has to be
+        # rendered again, and the accepting states the lines were rendered for.
+        self._lines: list[str | None] | None = None
+        self._stale: set[int] = set()
+        self._lineFinals: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    @property
+    def start(self) -> int:
+        return STATES.intern(self.prefix, 0)
+
+    @property
+    def final(self) -> int:
+        return STATES.intern(self.prefix, 'f')
+
+    def add_state(self, sid: int):
+        if sid not in self._seen:
+            self._seen.add(sid)
+            if self._statePos is not None:
+                self._statePos[sid] = len(self.states)
+            self.states.append(sid)
+            if self._sorted is not None:
+                num = bisect.bisect_left(self._sorted, STATES.keys[sid], key=STATES.keys.__getitem__)
+                self._sorted.insert(num, sid)
+                self._sortedNames.insert(num, STATES.name(sid))
+                if self._lines is not None:
+                    self._lines.insert(num, None)
+                    self._stale.add(sid)
+
+    def _drop_state(self, sid: int):
+        self._seen.discard(sid)
+        self.marked.discard(sid)
+        # The last state takes its place.
+        num = self._statePos.pop(sid)
+        last = self.states.pop()
+        if last != sid:
+            self.states[num] = last
+            self._statePos[last] = num
+        if self._sorted is not None:
+            num = bisect.bisect_left(self._sorted, STATES.keys[sid], key=STATES.keys.__getitem__)
+            del self._sorted[num], self._sortedNames[num]
+            if self._lines is not None:
+                del self._lines[num]
+        self._rows.pop(sid, None)
+        self._stale.discard(sid)
+
+    def _redo_row(self, sid: int):
+        # The δ row of sid changed.
+        self._rows.pop(sid, None)
+        self._stale.add(sid)
+
+    def _redo_rows(self):
+        # The labels changed, so every δ row did.
+        self._rows.clear()
+        self._lines = None
+        self._stale.clear()
+
+    def add(self, src: int, lab: int, dst: int):
+        self._sim = self._index = None
+        self.add_state(src)
+        self.add_state(dst)
+        self.src.append(src)
+        self.lab.append(lab)
+        self.dst.append(dst)
+        if self._deltas is not None:
+            self._deltas.append(Delta(STATES.name(src), SYMBOLS.names[lab], STATES.name(dst)))
+        if self._at is not None:
+            pos = len(self.src) - 1
+            self._at.setdefault(src, list()).append(pos)
+            if dst != src:
+                self._at.setdefault(dst, list()).append(pos)
+            self._labCount[lab] = self._labCount.get(lab, 0) + 1
+            self._redo_row(src)
+            if self._labCount[lab] == 1 and self._labels is not None:
+                self._labels = None
+                self._redo_rows()
+        else:
+            self._labels = None
+
+    def extend(self, other: 'Automaton'):
+        """
+        Copies all the states and transitions of other into this automaton.
+        """
+        self._forget()
+        seen = self._seen
+        new = [sid for sid in other.states if sid not in seen]
+        seen.update(new)
+        self.states.extend(new)
+        self.src.extend(other.src)
+        self.lab.extend(other.lab)
+        self.dst.extend(other.dst)
+
+    def copy(self) -> 'Automaton':
+        """
+        :return: An automaton with the same prefix, accepting states and transitions.
+        """
+        auto = Automaton(self.prefix, self.finals)
+        auto.marked.update(self.marked)
+        auto.extend(self)
+        return auto
+
+    def mark(self, written: int | str, sid: int):
+        """
+        Notes how a state was written in a transition list: a q_f written in full
+        with its trailing space (as state() formats it) is marked \\ACC in the δ
+        table, even when it is another machine's q_f and so not accepting here.
+        :param written: The state as written.
+        :param sid: Its id.
+        """
+        if isinstance(written, str) and written.endswith(' ') and STATES.idxs[sid] == 'f':
+            self.marked.add(sid)
+
+    def _edit_views(self):
+        # Builds the views that edits keep up to date.
+        if self._at is None:
+            self._at, self._labCount = dict(), dict()
+            for pos, (src, lab, dst) in enumerate(zip(self.src, self.lab, self.dst)):
+                self._at.setdefault(src, list()).append(pos)
+                if dst != src:
+                    self._at.setdefault(dst, list()).append(pos)
+                self._labCount[lab] = self._labCount.get(lab, 0) + 1
+            self._statePos = dict([(sid, num) for num, sid in enumerate(self.states)])
+
+    def find(self, src: int, lab: int, dst: int) -> int:
+        """
+        Only looks at the transitions of src.
+        :return: The position of the first transition src -lab-> dst in src, lab and dst.
+        """
+        self._edit_views()
+        for pos in self._at.get(src, ()):
+            if self.src[pos] == src and self.lab[pos] == lab and self.dst[pos] == dst:
+                return pos
+        raise ValueError(f"There is no transition {STATES.name(src)} -{SYMBOLS.names[lab]}-> "
+                         f"{STATES.name(dst)}.")
+
+    def remove(self, src: int, lab: int, dst: int) -> int:
+        """
+        Removes the first transition src -lab-> dst, the last transition takes
+        its place. A state left without any transitions is removed too, as it
+        would not be in an automaton built from the remaining transitions.
+        :return: The position the transition was at.
+        """
+        pos = self.find(src, lab, dst)
+        self._sim = self._index = None
+        last = len(self.src) - 1
+        for sid in set((src, dst)):
+            self._at[sid].remove(pos)
+        if pos != last:
+            for sid in set((self.src[last], self.dst[last])):
+                positions = self._at[sid]
+                positions.pop()
+                bisect.insort(positions, pos)
+            self.src[pos], self.lab[pos], self.dst[pos] = self.src[last], self.lab[last], self.dst[last]
+            if self._deltas is not None:
+                self._deltas[pos] = self._deltas[last]
+            self._redo_row(self.src[pos])
+        self.src.pop(), self.lab.pop(), self.dst.pop()
+        if self._deltas is not None:
+            self._deltas.pop()
+        self._redo_row(src)
+        self._labCount[lab] -= 1
+        if not self._labCount[lab]:
+            del self._labCount[lab]
+            self._labels = None
+            self._redo_rows()
+        for sid in set((src, dst)):
+            if not self._at[sid]:
+                del self._at[sid]
+                self._drop_state(sid)
+        return pos
+
+    def rename(self, old: int, new: int) -> list[int]:
+        """
+        Renames a state everywhere it is used (its transitions and the accepting
+        states). Only the rows of old and of the states with moves to it change.
+        :param old: A state of this automaton other than the start state.
+        :param new: A state that is not in this automaton.
+        :return: The positions of the transitions renamed.
+        """
+        if old not in self._seen:
+            raise ValueError(f"There is no state {STATES.name(old)}.")
+        if old == self.start:
+            raise ValueError(f"The start state {STATES.name(old)} can't be renamed.")
+        if new in self._seen:
+            raise ValueError(f"There already is a state {STATES.name(new)}.")
+        self._edit_views()
+        self._sim = self._index = None
+        touched = self._at.pop(old)
+        for pos in touched:
+            if self.src[pos] == old:
+                self.src[pos] = new
+            if self.dst[pos] == old:
+                self.dst[pos] = new
+            if self._deltas is not None:
+                self._deltas[pos] = Delta(STATES.name(self.src[pos]), SYMBOLS.names[self.lab[pos]],
+                                          STATES.name(self.dst[pos]))
+            self._redo_row(self.src[pos])
+        self._at[new] = touched
+        self._drop_state(old)
+        self.add_state(new)
+        self.finals = [new if sid == old else sid for sid in self.finals]
+        if old in self.marked:
+            self.marked.discard(old)
+            self.marked.add(new)
+        return touched
+
+    @classmethod
+    def from_transitions(cls, name: str, transitions: transitions_type,
+                         prefix: str | None = None, accepting: 'acceptingType' = ('f',)) -> 'Automaton':
+        """
+        Interns a transition list as accepted by Machine and getMachine.
+        :param name: The machine name, 0, 'f' and integer indexes are states of this machine.
+        :param transitions: The transitions.
+        :param prefix: Overrides the prefix derived from name.
+        :param accepting: The accepting states, written as in the transitions.
+        :return: The automaton for the transitions.
+        """
+        if prefix is None:
+            prefix = idx_2(name)
+        auto = Automaton(prefix, [state_id(prefix, acc) for acc in accepting])
+        match transitions:
+            case Thompson() | Regex():
+                flat = transitions.flatten(prefix)
+                flat.finals = auto.finals
+                return flat
+            case []:
+                # No moves at all (an empty product, say): Q is still {q0}.
+                auto.add_state(auto.start)
             # Determine which type of transition it is and handle it.
             case [*deltas]:
                 for delta in deltas:
                     match delta:
                         case (fromIdx, onType as on, toIdx):
-                            def match_to_state(possIdx: int | str) -> str:
-                                match possIdx:
-                                    case '0' | 'f' | int(_):
-                                        # Add my prefix and create a state.
-                                        return state(prefix, possIdx)
-                                    case str():
-                                        # This is already a fully formatted state.
-                                        return possIdx
-                                    case _:
-                                        raise ValueError(
-                                            f"Unrecognized transition element {possIdx} in transition {delta}")
-
-                            fromName = match_to_state(fromIdx)
-                            toName = match_to_state(toIdx)
-                            deltasTable.append(Delta(fromName, on, toName))
+                            try:
+                                src, dst = state_id(prefix, fromIdx), state_id(prefix, toIdx)
+                            except ValueError as e:
+                                raise ValueError(f"{e} in transition {delta}") from e
+                            auto.add(src, SYMBOLS.intern(on), dst)
+                            auto.mark(fromIdx, src)
+                            auto.mark(toIdx, dst)
                         case transition if isinstance(transition, Delta):
-                            # states.add(transition.fromState)
-                            # states.add(transition.toState)
-                            deltasTable.append(transition)
+                            src, dst = STATES.parse(transition.fromState), STATES.parse(transition.toState)
+                            auto.add(src, SYMBOLS.intern(transition.on), dst)
+                            auto.mark(transition.fromState, src)
+                            auto.mark(transition.toState, dst)
                         case _:
                             raise ValueError(f"No match found for {delta}.")
             case str(on):
-                # states.add(fromName := state(prefix, 0))
-                # states.add(toName := state(prefix, 0))
-                deltasTable.append(Delta(state(prefix, 0), on, state(prefix, 0)))
+                auto.add(auto.start, SYMBOLS.intern(on), auto.final)
             case _:
-                raise ValueError(f"No match found for {self.transitions}.")
+                raise ValueError(f"No match found for {transitions}.")
+        return auto
+
+    def to_deltas(self, trim: bool = False) -> list[Delta]:
+        """
+        :param trim: Whether the state names are passed through norm_st.
+        :return: The transitions as Delta instances.
+        """
+        name = (lambda sid: norm_st(STATES.name(sid))) if trim else STATES.name
+        if not trim and self._deltas is not None:
+            return list(self._deltas)
+        deltas = [Delta(name(src), SYMBOLS.names[lab], name(dst))
+                  for src, lab, dst in zip(self.src, self.lab, self.dst)]
+        if not trim:
+            self._deltas = deltas
+            return list(deltas)
+        return deltas
+
+    def numbering(self) -> dict[int, int]:
+        """
+        :return: A map from the id of every state (including the start state) to
+            a dense local number 0..n-1, in the order the states were first seen.
+        """
+        local = dict([(sid, num) for num, sid in enumerate(self.states)])
+        local.setdefault(self.start, len(local))
+        return local
+
+    def adjacency(self, local: dict[int, int], reverse: bool = False) -> tuple[list[int], list[int]]:
+        """
+        Indexes the transitions by state (a counting sort, linear in the transitions).
+        :param local: The local number of every state, see numbering.
+        :param reverse: Index the transitions entering each state instead of leaving it.
+        :return: (ptr, pos), the transitions of local state i are at the positions
+            pos[ptr[i]:ptr[i + 1]] of src, lab and dst.
+        """
+        ends = self.dst if reverse else self.src
+        ptr = [0] * (len(local) + 1)
+        for sid in ends:
+            ptr[local[sid] + 1] += 1
+        for num in range(len(local)):
+            ptr[num + 1] += ptr[num]
+        fill = ptr[:-1]
+        pos = [0] * len(ends)
+        for tid, sid in enumerate(ends):
+            num = local[sid]
+            pos[fill[num]] = tid
+            fill[num] += 1
+        return ptr, pos
+
+    @staticmethod
+    def eps_closures(epsSucc: list[list[int]]) -> list[int]:
+        """
+        Computes the ε-closure of every state as a bitset (bit i is local state i).
+        The ε graph is condensed into its strongly connected components (iterative
+        Tarjan), which come out in reverse topological order so each closure is
+        built from closures that are already known. Linear in the ε transitions.
+        :param epsSucc: The ε successors of each local state.
+        :return: The closure of each local state.
+        """
+        n = len(epsSucc)
+        closure = [0] * n
+        index = [-1] * n
+        low = [0] * n
+        onStack = [False] * n
+        stack: list[int] = []
+        counter = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, child = work.pop()
+                if child == 0:
+                    index[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    onStack[node] = True
+                else:
+                    low[node] = min(low[node], low[epsSucc[node][child - 1]])
+                while child < len(epsSucc[node]):
+                    nxt = epsSucc[node][child]
+                    child += 1
+                    if index[nxt] == -1:
+                        work.append((node, child))
+                        work.append((nxt, 0))
+                        break
+                    if onStack[nxt]:
+                        low[node] = min(low[node], index[nxt])
+                else:
+                    if low[node] == index[node]:
+                        # node is the root of a component, everything it reaches
+                        # outside the component is already closed.
+                        members = []
+                        mask = 0
+                        while True:
+                            member = stack.pop()
+                            onStack[member] = False
+                            members.append(member)
+                            mask |= 1 << member
+                            if member == node:
+                                break
+                        for member in members:
+                            for nxt in epsSucc[member]:
+                                mask |= closure[nxt]
+                        for member in members:
+                            closure[member] = mask
+        return closure
+
+    def determinize(self) -> 'Automaton':
+        """
+        Subset construction. ε-closures are precomputed as int bitsets, and only
+        the subsets reachable from the start state are explored, using a worklist
+        and a subset -> id hash index. Moves that lead nowhere are left out rather
+        than going to a dead state.
+        :return: A deterministic automaton with the same prefix. Its states are
+            numbered 0 (start) upwards in the order they were discovered.
+        """
+        local = self.numbering()
+        n = len(local)
+        epsSucc: list[list[int]] = [list() for _ in range(n)]
+        move: list[dict[int, int]] = [dict() for _ in range(n)]
+        for src, lab, dst in zip(self.src, self.lab, self.dst):
+            fromNum, toNum = local[src], local[dst]
+            for ele in SYMBOLS.parts[lab]:
+                if ele == EPS:
+                    epsSucc[fromNum].append(toNum)
+                else:
+                    move[fromNum][ele] = move[fromNum].get(ele, 0) | (1 << toNum)
+        closure = self.eps_closures(epsSucc)
+        finalMask = 0
+        for sid in self.finals:
+            if sid in local:
+                finalMask |= 1 << local[sid]
+
+        closed: dict[int, int] = dict()
+
+        def close(mask: int) -> int:
+            result = closed.get(mask)
+            if result is None:
+                result = 0
+                rest = mask
+                while rest:
+                    bit = rest & -rest
+                    result |= closure[bit.bit_length() - 1]
+                    # Closures are closed, anything already in result is covered.
+                    rest &= ~result
+                closed[mask] = result
+            return result
+
+        startSet = close(1 << local[self.start])
+        ids: dict[int, int] = {startSet: 0}
+        subsets = [startSet]
+        dfa = Automaton(self.prefix, [])
+        dfa.add_state(STATES.intern(self.prefix, 0))
+        pos = 0
+        while pos < len(subsets):
+            subset = subsets[pos]
+            fromSid = STATES.intern(self.prefix, pos)
+            if subset & finalMask:
+                dfa.finals.append(fromSid)
+            targets: dict[int, int] = dict()
+            rest = subset
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                for ele, mask in move[bit.bit_length() - 1].items():
+                    targets[ele] = targets.get(ele, 0) | mask
+            for ele in sorted(targets, key=SYMBOLS.names.__getitem__):
+                target = close(targets[ele])
+                toNum = ids.get(target)
+                if toNum is None:
+                    toNum = ids[target] = len(subsets)
+                    subsets.append(target)
+                dfa.add(fromSid, ele, STATES.intern(self.prefix, toNum))
+            pos += 1
+        return dfa
+
+    def is_deterministic(self) -> bool:
+        """
+        :return: Whether there are no ε transitions and no state has two
+            transitions on the same element.
+        """
+        seen: set[tuple[int, int]] = set()
+        for src, lab in zip(self.src, self.lab):
+            for ele in SYMBOLS.parts[lab]:
+                if ele == EPS or (src, ele) in seen:
+                    return False
+                seen.add((src, ele))
+        return True
+
+    def minimize(self) -> 'Automaton':
+        """
+        Hopcroft's partition refinement, O(n·|Σ| log n). A non deterministic
+        automaton is determinized first. Missing moves go to an implicit dead
+        state, which (with every state equivalent to it) is left out of the result,
+        as are states unreachable from the start state.
+        :return: The minimal deterministic automaton with the same prefix. Its
+            states are numbered 0 (start) upwards in breadth first order.
+        """
+        dfa = self if self.is_deterministic() else self.determinize()
+        delta: dict[int, dict[int, int]] = dict()
+        for src, lab, dst in zip(dfa.src, dfa.lab, dfa.dst):
+            for ele in SYMBOLS.parts[lab]:
+                delta.setdefault(src, dict())[ele] = dst
+
+        # Number the reachable states breadth first, the dead state comes last.
+        order = [dfa.start]
+        local = {dfa.start: 0}
+        for sid in order:
+            for dst in delta.get(sid, dict()).values():
+                if dst not in local:
+                    local[dst] = len(order)
+                    order.append(dst)
+        n = len(order)
+        dead = n
+        sigma = sorted(set([ele for sid in order for ele in delta.get(sid, dict())]),
+                       key=SYMBOLS.names.__getitem__)
+        # inverse[c][q] are the states moving to q on sigma[c].
+        inverse: list[dict[int, list[int]]] = [dict() for _ in sigma]
+        for col, ele in enumerate(sigma):
+            preds = inverse[col]
+            for num, sid in enumerate(order):
+                dst = delta.get(sid, dict()).get(ele)
+                preds.setdefault(local[dst] if dst is not None else dead, list()).append(num)
+            preds.setdefault(dead, list()).append(dead)
+
+        finals = set([local[sid] for sid in dfa.finals if sid in local])
+        blocks: list[set[int]] = [block for block in (set(finals), set(range(n + 1)) - finals) if block]
+        blockOf = [0] * (n + 1)
+        for bid, block in enumerate(blocks):
+            for num in block:
+                blockOf[num] = bid
+        waiting = set([min(range(len(blocks)), key=lambda bid: len(blocks[bid]))])
+        while waiting:
+            splitter = list(blocks[waiting.pop()])
+            for preds in inverse:
+                touched: dict[int, list[int]] = dict()
+                for num in splitter:
+                    for pred in preds.get(num, ()):
+                        touched.setdefault(blockOf[pred], list()).append(pred)
+                for bid, inside in touched.items():
+                    if len(inside) == len(blocks[bid]):
+                        continue
+                    newBid = len(blocks)
+                    blocks[bid].difference_update(inside)
+                    blocks.append(set(inside))
+                    for num in inside:
+                        blockOf[num] = newBid
+                    if bid in waiting:
+                        waiting.add(newBid)
+                    else:
+                        waiting.add(newBid if len(inside) <= len(blocks[bid]) else bid)
+
+        # Renumber the blocks breadth first from the start, skipping the dead block.
+        minimal = Automaton(self.prefix, [])
+        deadBid = blockOf[dead]
+        ids = {blockOf[0]: 0}
+        queue = [blockOf[0]]
+        minimal.add_state(STATES.intern(self.prefix, 0))
+        for bid in queue:
+            if bid == deadBid:
+                continue
+            rep = next(iter(blocks[bid]))
+            fromSid = STATES.intern(self.prefix, ids[bid])
+            if rep in finals:
+                minimal.finals.append(fromSid)
+            for ele in sigma:
+                dst = delta.get(order[rep], dict()).get(ele)
+                if dst is None or blockOf[local[dst]] == deadBid:
+                    continue
+                toBid = blockOf[local[dst]]
+                if toBid not in ids:
+                    ids[toBid] = len(ids)
+                    queue.append(toBid)
+                minimal.add(fromSid, ele, STATES.intern(self.prefix, ids[toBid]))
+        return minimal
+
+    def dfa_table(self) -> tuple[int, list[list[tuple[int, int]]], bytearray]:
+        """
+        Numbers the states of this automaton (determinized first if needed) and
+        lists each state's moves.
+        :return: (start, moves, finals): the local number of the start state, the
+            (element, target) moves of every local state sorted by element name,
+            and whether every local state is accepting.
+        """
+        dfa = self if self.is_deterministic() else self.determinize()
+        local = dfa.numbering()
+        rows: list[dict[int, int]] = [dict() for _ in local]
+        for src, lab, dst in zip(dfa.src, dfa.lab, dfa.dst):
+            for ele in SYMBOLS.parts[lab]:
+                rows[local[src]][ele] = local[dst]
+        finals = bytearray(len(local))
+        for sid in dfa.finals:
+            if sid in local:
+                finals[local[sid]] = 1
+        moves = [sorted(row.items(), key=lambda move: SYMBOLS.names[move[0]]) for row in rows]
+        return local[dfa.start], moves, finals
+
+    INTERSECT = 'intersect'
+    DIFFERENCE = 'difference'
+
+    def product(self, other: 'Automaton', op: str, prefix: str | None = None) -> 'Automaton':
+        """
+        The product construction, built on the fly: only the pairs of states
+        reachable from (q0, q0) are explored, using a worklist and a pair -> id
+        hash index, so two large DFAs never give |Q|·|Q'| states up front. Both
+        automata are determinized first (if needed), and a move one of them lacks
+        goes to an implicit dead state. Pairs that can't lead to acceptance (this
+        automaton's side dead, or for an intersection either side) are not explored.
+        :param other: The right hand side.
+        :param op: Automaton.INTERSECT (both accept) or Automaton.DIFFERENCE (this
+            automaton accepts and other does not).
+        :param prefix: The prefix of the result, by default this automaton's.
+        :return: A deterministic automaton whose states are numbered 0 (start)
+            upwards in breadth first order.
+        """
+        if op not in (Automaton.INTERSECT, Automaton.DIFFERENCE):
+            raise ValueError(f"Unrecognized product {op!r}.")
+        return Automaton._explore(self.dfa_table(), other.dfa_table(), op,
+                                  self.prefix if prefix is None else prefix)
+
+    def complement(self, sigma: typing.Iterable[str] = (), prefix: str | None = None) -> 'Automaton':
+        """
+        :param sigma: Elements of Σ besides the ones this automaton uses.
+        :param prefix: The prefix of the result, by default this automaton's.
+        :return: A deterministic automaton accepting the words over Σ this one
+            rejects (the difference of Σ* and this automaton).
+        """
+        eles = set([ele for ele in self.sigma() if ele != EPS] + [SYMBOLS.intern(ele) for ele in sigma])
+        universal = (0, [sorted([(ele, 0) for ele in eles], key=lambda move: SYMBOLS.names[move[0]])],
+                     bytearray(b'\x01'))
+        return Automaton._explore(universal, self.dfa_table(), Automaton.DIFFERENCE,
+                                  self.prefix if prefix is None else prefix)
+
+    @staticmethod
+    def _explore(left: tuple[int, list[list[tuple[int, int]]], bytearray],
+                 right: tuple[int, list[list[tuple[int, int]]], bytearray], op: str, prefix: str) -> 'Automaton':
+        # Explores the product of two dfa_tables, see product.
+        lStart, lMoves, lFinals = left
+        rStart, rMoves, rFinals = right
+        rMoves = [dict(row) for row in rMoves]
+        dead = len(rMoves)
+        rMoves.append(dict())
+        rFinals = rFinals + b'\x00'
+        intersect = op == Automaton.INTERSECT
+        start = (lStart, rStart)
+        ids: dict[tuple[int, int], int] = {start: 0}
+        pairs = [start]
+        result = Automaton(prefix, [])
+        result.add_state(STATES.intern(prefix, 0))
+        pos = 0
+        while pos < len(pairs):
+            lNum, rNum = pairs[pos]
+            fromSid = STATES.intern(prefix, pos)
+            if lFinals[lNum] and (rFinals[rNum] if intersect else not rFinals[rNum]):
+                result.finals.append(fromSid)
+            rRow = rMoves[rNum]
+            for ele, lDst in lMoves[lNum]:
+                rDst = rRow.get(ele, dead)
+                if intersect and rDst == dead:
+                    continue
+                pair = (lDst, rDst)
+                toNum = ids.get(pair)
+                if toNum is None:
+                    toNum = ids[pair] = len(pairs)
+                    pairs.append(pair)
+                result.add(fromSid, ele, STATES.intern(prefix, toNum))
+            pos += 1
+        return result
+
+    def counterexample(self, other: 'Automaton') -> list[int] | None:
+        """
+        Checks whether two automata accept the same language with Hopcroft and
+        Karp's algorithm: starting from the pair of start states, pairs of states
+        reached on the same element are merged in a union-find structure (a move
+        an automaton lacks goes to its dead state) until every merged pair has been
+        checked, near linear in the size of the two DFAs. NFAs are determinized
+        (with their ε-closures) first. Only when the languages differ, a breadth
+        first search of the pairs finds a shortest word telling them apart.
+        :param other: The automaton to compare with.
+        :return: None when the languages are equal, otherwise the element ids of a
+            shortest word accepted by exactly one of the automata (the first in
+            order of element names).
+        """
+        lStart, lMoves, lFinals = self.dfa_table()
+        rStart, rMoves, rFinals = other.dfa_table()
+        # Both sides in one numbering, left states then right states, each side
+        # followed by its dead state.
+        offset = len(lMoves) + 1
+        moves = ([dict(row) for row in lMoves] + [dict()] +
+                 [dict([(ele, dst + offset) for ele, dst in row]) for row in rMoves] + [dict()])
+        finals = lFinals + b'\x00' + rFinals + b'\x00'
+        lDead, rDead = offset - 1, len(moves) - 1
+        parent = list(range(len(moves)))
+
+        def find(num: int) -> int:
+            while parent[num] != num:
+                parent[num] = parent[parent[num]]
+                num = parent[num]
+            return num
+
+        start = (lStart, rStart + offset)
+        parent[start[1]] = start[0]
+        pending = [start]
+        equal = True
+        while pending:
+            lNum, rNum = pending.pop()
+            if finals[lNum] != finals[rNum]:
+                equal = False
+                break
+            lRow, rRow = moves[lNum], moves[rNum]
+            for ele in set(lRow).union(rRow):
+                lDst, rDst = find(lRow.get(ele, lDead)), find(rRow.get(ele, rDead))
+                if lDst != rDst:
+                    parent[rDst] = lDst
+                    pending.append((lRow.get(ele, lDead), rRow.get(ele, rDead)))
+        if equal:
+            return None
+
+        names = SYMBOLS.names
+        back: dict[tuple[int, int], tuple[tuple[int, int], int] | None] = {start: None}
+        queue = [start]
+        for lNum, rNum in queue:
+            if finals[lNum] != finals[rNum]:
+                word = []
+                pair = (lNum, rNum)
+                while back[pair] is not None:
+                    pair, ele = back[pair]
+                    word.append(ele)
+                return word[::-1]
+            lRow, rRow = moves[lNum], moves[rNum]
+            for ele in sorted(set(lRow).union(rRow), key=names.__getitem__):
+                pair = (lRow.get(ele, lDead), rRow.get(ele, rDead))
+                if pair not in back:
+                    back[pair] = ((lNum, rNum), ele)
+                    queue.append(pair)
+        raise AssertionError("Hopcroft-Karp found a difference the search did not.")
+
+    def count_words(self, n: int, exact: bool = False) -> int:
+        """
+        Counts the accepted words by dynamic programming over the numpy matrix of
+        the minimal DFA, where entry (i, j) is the number of elements moving
+        local state i to j. Counts are kept as python ints (an object array) so
+        they are exact for any length. The n products of the matrix with a vector
+        are replaced by repeated squaring when that takes fewer operations.
+        :param n: The length of the words.
+        :param exact: Only count words of length n, rather than of length up to n.
+        :return: The number of words.
+        """
+        require_numpy()
+        start, moves, finals = self.minimize().dfa_table()
+        q = len(moves)
+        # With exact False a last column is added that collects the accepted
+        # words of every length: its entry in M^(n + 1) is the count up to n.
+        size = q if exact else q + 1
+        matrix = np.zeros((size, size), dtype=object)
+        for num, row in enumerate(moves):
+            for ele, dst in row:
+                matrix[num, dst] += 1
+        vector = np.zeros(size, dtype=object)
+        if exact:
+            vector[:q] = list(finals)
+            steps = n
+        else:
+            matrix[:q, q] = list(finals)
+            matrix[q, q] = 1
+            vector[q] = 1
+            steps = n + 1
+        if steps.bit_length() * size < steps:
+            power = np.identity(size, dtype=object)
+            while steps:
+                if steps & 1:
+                    power = power @ matrix
+                matrix = matrix @ matrix
+                steps >>= 1
+            vector = power @ vector
+        else:
+            for _ in range(steps):
+                vector = matrix @ vector
+        return int(vector[start])
+
+    def iter_words(self, maxLen: int) -> typing.Iterator[tuple[int, ...]]:
+        """
+        Generates the accepted words of length up to maxLen in shortlex order
+        (shorter first, then by element names). Each length is a depth first
+        search of the minimal DFA that only follows moves into states that can
+        still accept in exactly the remaining number of moves, so no search is
+        wasted: the cost is linear in the words generated, and only the current
+        word is held.
+        :param maxLen: The longest words wanted.
+        :return: The element ids of each word.
+        """
+        start, moves, finals = self.minimize().dfa_table()
+        # live[r] is the bitset of the states that accept a word of length r.
+        live = [sum([1 << num for num, final in enumerate(finals) if final])]
+        for _ in range(maxLen):
+            live.append(sum([1 << num for num, row in enumerate(moves)
+                             if any([(live[-1] >> dst) & 1 for _, dst in row])]))
+        for length in range(maxLen + 1):
+            if not (live[length] >> start) & 1:
+                continue
+            word: list[int] = []
+            stack = [(start, 0)]
+            while stack:
+                num, pos = stack[-1]
+                remaining = length - len(word)
+                row = moves[num]
+                if remaining:
+                    canAccept = live[remaining - 1]
+                    while pos < len(row) and not (canAccept >> row[pos][1]) & 1:
+                        pos += 1
+                if not remaining or pos == len(row):
+                    if not remaining:
+                        yield tuple(word)
+                    stack.pop()
+                    if stack:
+                        word.pop()
+                    continue
+                ele, dst = row[pos]
+                stack[-1] = (num, pos + 1)
+                word.append(ele)
+                stack.append((dst, 0))
+
+    def trim(self) -> 'Automaton':
+        """
+        Removes the states that can't be reached from the start state or can't
+        reach an accepting state, with their transitions. Both sweeps walk an
+        adjacency index, so this is linear in the transitions. The start state is
+        always kept.
+        :return: A new automaton with the same prefix, language and state names.
+        """
+        local = self.numbering()
+        n = len(local)
+
+        def sweep(seeds: list[int], reverse: bool) -> bytearray:
+            ptr, pos = self.adjacency(local, reverse)
+            ends = self.src if reverse else self.dst
+            seen = bytearray(n)
+            stack = []
+            for num in seeds:
+                if not seen[num]:
+                    seen[num] = 1
+                    stack.append(num)
+            while stack:
+                num = stack.pop()
+                for tid in pos[ptr[num]:ptr[num + 1]]:
+                    nxt = local[ends[tid]]
+                    if not seen[nxt]:
+                        seen[nxt] = 1
+                        stack.append(nxt)
+            return seen
+
+        reached = sweep([local[self.start]], False)
+        live = sweep([local[sid] for sid in self.finals if sid in local], True)
+        useful = lambda sid: reached[local[sid]] and live[local[sid]]
+        trimmed = Automaton(self.prefix, [sid for sid in self.finals if sid in local and useful(sid)])
+        trimmed.add_state(self.start)
+        for src, lab, dst in zip(self.src, self.lab, self.dst):
+            if useful(src) and useful(dst):
+                trimmed.add(src, lab, dst)
+        return trimmed
+
+    def remove_epsilons(self) -> 'Automaton':
+        """
+        Replaces the ε transitions: every state gets the moves of the states in its
+        ε-closure, and is accepting when its closure holds an accepting state. The
+        closures come from eps_closures and the moves from an adjacency index, so
+        this is linear in the size of the result. States that were only entered by
+        ε transitions are left unreachable, trim removes them.
+        :return: A new automaton without ε transitions, with the same prefix,
+            language and state names.
+        """
+        local = self.numbering()
+        order = list(local)
+        epsSucc: list[list[int]] = [list() for _ in order]
+        for src, lab, dst in zip(self.src, self.lab, self.dst):
+            if EPS in SYMBOLS.parts[lab]:
+                epsSucc[local[src]].append(local[dst])
+        closure = self.eps_closures(epsSucc)
+        ptr, pos = self.adjacency(local)
+        finalMask = 0
+        for sid in self.finals:
+            if sid in local:
+                finalMask |= 1 << local[sid]
+
+        result = Automaton(self.prefix, [])
+        result.add_state(self.start)
+        for num, sid in enumerate(order):
+            if closure[num] & finalMask:
+                result.finals.append(sid)
+            moves: set[tuple[int, int]] = set()
+            rest = closure[num]
+            while rest:
+                bit = rest & -rest
+                rest ^= bit
+                other = bit.bit_length() - 1
+                for tid in pos[ptr[other]:ptr[other + 1]]:
+                    lab, dst = self.lab[tid], self.dst[tid]
+                    parts = SYMBOLS.parts[lab]
+                    # A label such as '\epsilon, a' keeps its other elements.
+                    for move in ([(ele, dst) for ele in parts if ele != EPS] if EPS in parts else [(lab, dst)]):
+                        if move not in moves:
+                            moves.add(move)
+                            result.add(sid, *move)
+        result.finals = [sid for sid in result.finals if sid in result._seen]
+        return result
+
+    def to_machine(self, name: str) -> 'Machine':
+        """
+        :param name: The name of the machine, it should give this automaton's prefix.
+        :return: A machine with the states and transitions of this automaton, where
+            the states with this automaton's prefix are written by their idx so
+            that setName renames them.
+        """
+        mach = Machine(name, self.written(), [self.written_state(sid) for sid in self.finals])
+        if idx_2(name) == self.prefix:
+            mach._set_compiled(self)
+        return mach
+
+    def written_state(self, sid: int) -> int | str:
+        """
+        :return: The state as it is written in a transition list: a state with this
+            automaton's prefix by its idx (so setName renames it), another by its
+            name, normalized unless it is marked (see mark).
+        """
+        if STATES.prefixes[sid] == self.prefix:
+            return STATES.idxs[sid]
+        return STATES.name(sid) if sid in self.marked else norm_st(STATES.name(sid))
+
+    def written(self) -> list[tuple[int | str, str, int | str]]:
+        """
+        :return: The transitions as a transition list, see written_state.
+        """
+        state = self.written_state
+        return [(state(src), SYMBOLS.names[lab], state(dst)) for src, lab, dst in zip(self.src, self.lab, self.dst)]
+
+    def simulation(self) -> 'Simulation':
+        """
+        :return: This automaton compiled for running input, built on first use.
+        """
+        if self._sim is None:
+            self._sim = Simulation(self)
+        return self._sim
 
-        if TRIM_COMPOSED_ACC_STATES:
-            for delta in deltasTable:
-                delta.fromState = norm_st(delta.fromState)
-                delta.toState = norm_st(delta.toState)
-        # print(deltasTable)
-        return Machine(self.name, deltasTable)
+    def sorted_states(self) -> list[int]:
+        if self._sorted is None:
+            self._sorted = sorted(self.states, key=STATES.keys.__getitem__)
+            self._sortedNames = [STATES.name(sid) for sid in self._sorted]
+        return list(self._sorted)
+
+    def state_list(self) -> str:
+        """
+        :return: The names of the states in sorted order, separated by ', '.
+        """
+        self.sorted_states()
+        return ', '.join(self._sortedNames)
+
+    def labels(self) -> list[int]:
+        """
+        :return: The ids of the labels used by the transitions (as written, 'b, c'
+            is one label), sorted by name.
+        """
+        if self._labels is None:
+            self._labels = sorted(set(self.lab) if self._labCount is None else self._labCount,
+                                  key=SYMBOLS.names.__getitem__)
+        return list(self._labels)
+
+    def sigma(self) -> list[int]:
+        """
+        :return: The ids of the single elements used by the transitions, sorted by name.
+        """
+        eles = set()
+        for lab in self.labels():
+            eles.update(SYMBOLS.parts[lab])
+        return sorted(eles, key=SYMBOLS.names.__getitem__)
+
+    def row_cells(self, sid: int) -> str:
+        """
+        :return: The cells of the δ table row of state sid, a column per label
+            (cached until an edit changes them).
+        """
+        cells = self._rows.get(sid)
+        if cells is None:
+            self._edit_views()
+            cells = self._row_cells(sid, dict([(lab, col) for col, lab in enumerate(self.labels())]))
+        return cells
+
+    def _row_cells(self, sid: int, column: dict[int, int]) -> str:
+        # Renders and caches the cells of a row, given the column of each label.
+        byCol: dict[int, list[str]] = dict()
+        src, lab, dst = self.src, self.lab, self.dst
+        # In the order of the transitions, as a state's cells list them.
+        for pos in self._at.get(sid, ()):
+            if src[pos] == sid:
+                byCol.setdefault(column[lab[pos]], list()).append(STATES.name(dst[pos]))
+        cells = self._rows[sid] = join_cells(sorted(byCol.items()), len(column))
+        return cells
+
+    def to_table(self) -> str:
+        """
+        :return: The δ table of this automaton, as used by the templates.
+        """
+        return ''.join(self.iter_table())
+
+    def index(self) -> 'TransitionIndex':
+        """
+        :return: The sparse δ table of this automaton, built on first use.
+        """
+        if self._index is None:
+            self._index = TransitionIndex(self)
+        return self._index
+
+    def iter_table(self, mergeClasses: bool | None = None) -> typing.Iterator[str]:
+        """
+        :param mergeClasses: Split the labels into their elements and render each
+            class of elements with identical columns as one column, rather than a
+            column per label. By default MERGE_EQUIVALENT_COLUMNS.
+        :return: The δ table of this automaton in pieces of up to TABLE_CHUNK_ROWS rows.
+        """
+        if mergeClasses is None:
+            mergeClasses = MERGE_EQUIVALENT_COLUMNS
+        names = SYMBOLS.names
+        if mergeClasses:
+            index = self.index()
+            columns = [', '.join([names[index.sigma[col]] for col in cls]) for cls in index.classes]
+            finals = self.marked.union(self.finals)
+            lines = [self.table_line(sid, index.row_cells(num, True), finals) for num, sid in enumerate(index.rows)]
+        else:
+            columns = [names[lab] for lab in self.labels()]
+            lines = self.table_lines()
+        fields = dict(prefix=self.prefix,
+                      colDec='|'.join(list((len(columns) + 3) * 'c')),
+                      eles=' & '.join(columns))
+        yield tableHead.substitute(fields)
+        for start in range(0, len(lines), TABLE_CHUNK_ROWS):
+            yield ('\\\\ \\hline\n  ' if start else '') + '\\\\ \\hline\n  '.join(lines[start:start + TABLE_CHUNK_ROWS])
+        yield tableTail.substitute(fields)
+
+    @staticmethod
+    def table_line(sid: int, cells: str, finals: set[int]) -> str:
+        """
+        :return: The δ table line of state sid, without the separator before it.
+        """
+        return ''.join([('\\ACC ' if sid in finals else ''), STATES.name(sid), " & \\; & ", cells])
+
+    def table_lines(self) -> list[str]:
+        """
+        :return: The δ table lines of the sorted states, a column per label. Only
+            the lines an edit changed since the last call are rendered again.
+        """
+        finals = self.marked.union(self.finals)
+        self.sorted_states()
+        self._edit_views()
+        column = dict([(lab, col) for col, lab in enumerate(self.labels())])
+        cells = lambda sid: self._rows[sid] if sid in self._rows else self._row_cells(sid, column)
+        if self._lines is None:
+            self._lines = [self.table_line(sid, cells(sid), finals) for sid in self._sorted]
+        else:
+            # The accepting states may have been changed directly.
+            for sid in self._stale.union(finals.symmetric_difference(self._lineFinals)):
+                if sid in self._seen:
+                    num = bisect.bisect_left(self._sorted, STATES.keys[sid], key=STATES.keys.__getitem__)
+                    self._lines[num] = self.table_line(sid, cells(sid), finals)
+        self._stale = set()
+        self._lineFinals = finals
+        return self._lines
+
+    def merged_edges(self) -> typing.Iterator[tuple[int, list[int], int]]:
+        """
+        The transitions with parallel ones merged, in one pass over the index.
+        :return: (src, elements, dst) for every pair of states with transitions
+            between them, by source in sorted order; the elements are sorted by name.
+        """
+        index = self.index()
+        for num, sid in enumerate(index.rows):
+            groups: dict[int, list[int]] = dict()
+            for pos in range(index.rowPtr[num], index.rowPtr[num + 1]):
+                ele = index.sigma[index.cols[pos]]
+                eles = groups.setdefault(index.dsts[pos], list())
+                if not eles or eles[-1] != ele:
+                    eles.append(ele)
+            for dst, eles in groups.items():
+                yield sid, eles, dst
+
+    def node_ids(self) -> dict[int, str]:
+        """
+        :return: A short id for every state (q0, q1, ... in sorted order), for exports.
+        """
+        return dict([(sid, f"q{num}") for num, sid in enumerate(self.index().rows)])
+
+    def write_mermaid(self, out: typing.TextIO):
+        """
+        Writes this automaton as a Mermaid flowchart: a node per state (accepting
+        states circled twice), an edge per pair of states labelled with all the
+        elements between them ('b,c'), a start marker and classDef styling.
+        Everything is streamed to out a line at a time, in time linear in the
+        transitions.
+        :param out: A file like object to write to.
+        """
+        ids = self.node_ids()
+        finals = set(self.finals)
+        label = lambda text: f"$${text}$$" if '\\' in text else text
+        out.write("flowchart LR\n")
+        for sid, node in ids.items():
+            name = STATES.name(sid).strip()
+            out.write(f'  {node}((("$${name}$$")))\n' if sid in finals else f'  {node}(("$${name}$$"))\n')
+        for src, eles, dst in self.merged_edges():
+            out.write(f"  {ids[src]} -->|{label(','.join([SYMBOLS.names[ele] for ele in eles]))}| {ids[dst]}\n")
+        if self.start in ids:
+            out.write(f"  start((start)) --> {ids[self.start]}\n")
+        out.write("  classDef state fill:#dde,stroke:#00f,stroke-width:2px;\n"
+                  "  classDef accept fill:#dde,stroke:#00f,stroke-width:4px;\n"
+                  "  classDef mach fill:#fff,stroke:#fff;\n")
+        for cls, members in (('state', [node for sid, node in ids.items() if sid not in finals]),
+                             ('accept', [node for sid, node in ids.items() if sid in finals])):
+            if members:
+                out.write("  class ")
+                for num, node in enumerate(members):
+                    out.write(f",{node}" if num else node)
+                out.write(f" {cls}\n")
+        out.write("  class start mach\n")
+
+    def write_dot(self, out: typing.TextIO, name: str | None = None):
+        """
+        Writes this automaton as a Graphviz digraph, with the same nodes and
+        merged edges as write_mermaid. Labels keep their LaTeX (for dot2tex).
+        :param out: A file like object to write to.
+        :param name: The name of the graph, by default M_prefix.
+        """
+        quote = lambda text: '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        ids = self.node_ids()
+        finals = set(self.finals)
+        out.write(f"digraph {quote(name if name is not None else 'M_' + Brace(self.prefix))} {{\n"
+                  "  rankdir=LR;\n"
+                  '  node [shape=circle, style=filled, fillcolor="#ddddee", color="#0000ff"];\n'
+                  "  start [shape=point];\n")
+        for sid, node in ids.items():
+            shape = ', shape=doublecircle' if sid in finals else ''
+            out.write(f"  {node} [label={quote(STATES.name(sid).strip())}{shape}];\n")
+        if self.start in ids:
+            out.write(f"  start -> {ids[self.start]};\n")
+        for src, eles, dst in self.merged_edges():
+            out.write(f"  {ids[src]} -> {ids[dst]} [label={quote(','.join([SYMBOLS.names[ele] for ele in eles]))}];\n")
+        out.write("}\n")
+
+
+class TransitionIndex:
+    """
+    δ of an automaton in compressed sparse row form. The rows are the states in
+    sorted order; the transitions leaving rows[r] are the entries
+    rowPtr[r]:rowPtr[r + 1] of cols and dsts, ordered by column, where a column
+    is the position of a single element in sigma. Everything is built in time
+    linear in the number of transitions (labels such as 'b, c' count once per
+    element).
+
+    The elements are also split into equivalence classes: elements whose
+    columns hold exactly the same cells are in the same class.
+
+    Examples:
+        >>> index = TransitionIndex(Automaton.from_transitions('M', [(0, 'a', 1), (1, 'b, c', 'f')]))
+        >>> [SYMBOLS.names[ele] for ele in index.sigma], index.classes
+        (['a', 'b', 'c'], [[0], [1, 2]])
+    """
+    __slots__ = ('rows', 'sigma', 'rowPtr', 'cols', 'dsts', 'classes', 'classOf')
+
+    def __init__(self, auto: Automaton):
+        self.rows = auto.sorted_states()
+        self.sigma = auto.sigma()
+        rowOf = dict([(sid, num) for num, sid in enumerate(self.rows)])
+        column = dict([(ele, col) for col, ele in enumerate(self.sigma)])
+        parts = SYMBOLS.parts
+        # Counting sort of the (row, column, destination) entries: by column
+        # first, then stably by row, so cells keep the order of δ.
+        entries = [(rowOf[src], column[ele], dst)
+                   for src, lab, dst in zip(auto.src, auto.lab, auto.dst) for ele in parts[lab]]
+        byCol: list[list[tuple[int, int, int]]] = [list() for _ in self.sigma]
+        for entry in entries:
+            byCol[entry[1]].append(entry)
+        byRow: list[list[tuple[int, int, int]]] = [list() for _ in self.rows]
+        for colEntries in byCol:
+            for entry in colEntries:
+                byRow[entry[0]].append(entry)
+        self.rowPtr = array.array('l', [0])
+        self.cols = array.array('l')
+        self.dsts = array.array('l')
+        for rowEntries in byRow:
+            self.cols.extend([col for _, col, _ in rowEntries])
+            self.dsts.extend([dst for _, _, dst in rowEntries])
+            self.rowPtr.append(len(self.cols))
+
+        # Elements are equivalent when their columns, read top to bottom, match.
+        classIds: dict[tuple[tuple[int, int], ...], int] = dict()
+        self.classes: list[list[int]] = list()
+        self.classOf: list[int] = list()
+        for colEntries in byCol:
+            key = tuple([(row, dst) for row, _, dst in colEntries])
+            cls = classIds.setdefault(key, len(self.classes))
+            if cls == len(self.classes):
+                self.classes.append(list())
+            self.classes[cls].append(len(self.classOf))
+            self.classOf.append(cls)
+
+    def __len__(self) -> int:
+        return len(self.cols)
+
+    def row_cells(self, num: int, merged: bool = False) -> str:
+        """
+        :param num: The row.
+        :param merged: One cell per equivalence class rather than per element.
+        :return: The cells of the δ table row, see join_cells.
+        """
+        cols, dsts = self.cols, self.dsts
+        pos, end = self.rowPtr[num], self.rowPtr[num + 1]
+        cells = list()
+        while pos < end:
+            col = cols[pos]
+            cell = list()
+            while pos < end and cols[pos] == col:
+                cell.append(STATES.name(dsts[pos]))
+                pos += 1
+            if not merged:
+                cells.append((col, cell))
+            elif self.classes[self.classOf[col]][0] == col:
+                # Classes are numbered in the order of their first element, so
+                # only the cells of those elements are needed.
+                cells.append((self.classOf[col], cell))
+        return join_cells(cells, len(self.classes) if merged else len(self.sigma))
+
+
+def join_cells(cells: typing.Iterable[tuple[int, list[str]]], count: int) -> str:
+    """
+    Joins the cells of a δ table row with ' & '. Only the cells holding states
+    are given, the runs of empty cells between them are filled in with one
+    repeated separator, so this is linear in the states rather than in Σ.
+    :param cells: (column, states) of the non empty cells, by column.
+    :param count: The number of columns.
+    :return: The row's cells.
+    """
+    row = list()
+    cur = 0
+    for col, cell in cells:
+        row.append(' & ' * (col - cur) + ', '.join(cell))
+        cur = col
+    if count - 1 > cur:
+        row.append(' & ' * (count - 1 - cur))
+    return ''.join(row)
+
+
+# Removes the ε transitions and then the useless states, see getMachine.
+SIMPLIFY_PASSES = (Automaton.remove_epsilons, Automaton.trim)
+
+passesType = typing.Sequence[typing.Callable[[Automaton], Automaton]] | None
+
+wordType = str | typing.Sequence[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class Equivalence:
+    """
+    The result of Machine.equivalent, true when the languages are equal.
+    Examples:
+        result = student.equivalent(reference)
+        if not result:
+            print(f"Wrong on {result.counterexample!r}")
+    """
+    equivalent: bool
+    # A shortest word accepted by exactly one of the machines: a str when its
+    # elements are single characters, otherwise a tuple of elements.
+    counterexample: wordType | None = None
+
+    def __bool__(self) -> bool:
+        return self.equivalent
+
+
+class Simulation:
+    """
+    An automaton compiled for running input through it. A word is either a str,
+    where each character is an element, or a sequence of elements (needed for
+    elements such as \\sigma).
+
+    A deterministic automaton becomes a dense state × element table with an
+    extra dead state. Otherwise the current states are kept as a bitset, with
+    every move already followed by its ε-closure. accepts runs one word in pure
+    python; accepts_many advances a whole batch of words in lock-step with numpy
+    gathers, through the table of a DFA or through the subset DFA of an NFA,
+    which is built only as far as the words go.
+    """
+    __slots__ = ('columns', 'deterministic', 'start', 'table', 'accepting', 'moves', 'finalMask', '_arrays')
+
+    def __init__(self, auto: Automaton):
+        local = auto.numbering()
+        n = len(local)
+        sigma = auto.sigma()
+        # Column k is every element not in the alphabet.
+        self.columns: dict[str, int] = dict([(SYMBOLS.names[ele], col)
+                                             for col, ele in enumerate([ele for ele in sigma if ele != EPS])])
+        k = len(self.columns)
+        column = dict([(SYMBOLS.intern(name), col) for name, col in self.columns.items()])
+        self.deterministic = auto.is_deterministic()
+        self._arrays = None
+        finals = [local[sid] for sid in auto.finals if sid in local]
+        if self.deterministic:
+            dead = n
+            self.table = [[dead] * (k + 1) for _ in range(n + 1)]
+            for src, lab, dst in zip(auto.src, auto.lab, auto.dst):
+                for ele in SYMBOLS.parts[lab]:
+                    self.table[local[src]][column[ele]] = local[dst]
+            self.start = local[auto.start]
+            self.accepting = [False] * (n + 1)
+            for num in finals:
+                self.accepting[num] = True
+        else:
+            epsSucc: list[list[int]] = [list() for _ in range(n)]
+            succ: list[list[int]] = [[0] * n for _ in range(k + 1)]
+            for src, lab, dst in zip(auto.src, auto.lab, auto.dst):
+                for ele in SYMBOLS.parts[lab]:
+                    if ele == EPS:
+                        epsSucc[local[src]].append(local[dst])
+                    else:
+                        succ[column[ele]][local[src]] |= 1 << local[dst]
+            closure = Automaton.eps_closures(epsSucc)
+
+            def close(mask: int) -> int:
+                result = 0
+                while mask:
+                    bit = mask & -mask
+                    result |= closure[bit.bit_length() - 1]
+                    mask &= ~result
+                return result
+
+            self.moves = [[close(mask) for mask in row] for row in succ]
+            self.start = closure[local[auto.start]]
+            self.finalMask = 0
+            for num in finals:
+                self.finalMask |= 1 << num
+
+    def accepts(self, word: wordType) -> bool:
+        """
+        :param word: The input.
+        :return: Whether the machine accepts it.
+        """
+        unknown = len(self.columns)
+        if self.deterministic:
+            table = self.table
+            cur = self.start
+            for ele in word:
+                cur = table[cur][self.columns.get(ele, unknown)]
+            return self.accepting[cur]
+        cur = self.start
+        for ele in word:
+            cur = self._move(cur, self.columns.get(ele, unknown))
+            if not cur:
+                return False
+        return bool(cur & self.finalMask)
+
+    def encode(self, words: list[wordType]) -> tuple['np.ndarray', 'np.ndarray']:
+        """
+        :param words: The input.
+        :return: The column of every element of every word, concatenated, and the
+            length of each word.
+        """
+        unknown = len(self.columns)
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        singles = [name for name in self.columns if len(name) == 1]
+        if all([isinstance(word, str) for word in words]):
+            # Decode all of the characters at once and look their columns up with
+            # a binary search over the single character elements.
+            chars = np.frombuffer(''.join(words).encode('utf-32-le'), dtype=np.uint32)
+            keys = np.array(sorted([ord(name) for name in singles]), dtype=np.uint32)
+            cols = np.array([self.columns[chr(key)] for key in keys] + [unknown], dtype=np.int64)
+            pos = np.searchsorted(keys, chars)
+            found = np.zeros(len(chars), dtype=bool)
+            inRange = pos < len(keys)
+            found[inRange] = keys[pos[inRange]] == chars[inRange]
+            codes = np.where(found, cols[np.minimum(pos, len(keys))], unknown)
+        else:
+            codes = np.fromiter([self.columns.get(ele, unknown) for word in words for ele in word],
+                                dtype=np.int64, count=int(lengths.sum()))
+        return codes, lengths
+
+    def accepts_many(self, words: typing.Iterable[wordType]) -> 'np.ndarray':
+        """
+        Runs a batch of words in lock-step. The words are sorted by length so the
+        ones still running are always a prefix of the batch.
+        :param words: The input.
+        :return: A bool array, whether the machine accepts each word.
+        """
+        require_numpy()
+        words = list(words)
+        codes, lengths = self.encode(words)
+        offsets = np.zeros(len(words), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        order = np.argsort(-lengths, kind='stable')
+        sortedLens = lengths[order]
+        pos = offsets[order]
+        maxLen = int(sortedLens[0]) if len(words) else 0
+        running = np.searchsorted(-sortedLens, -np.arange(maxLen), side='left')
+
+        result = np.empty(len(words), dtype=bool)
+        if self.deterministic:
+            if self._arrays is None:
+                self._arrays = (np.array(self.table, dtype=np.int32), np.array(self.accepting, dtype=bool))
+            table, accepting = self._arrays
+            cur = np.full(len(words), self.start, dtype=np.int32)
+            for step in range(maxLen):
+                act = running[step]
+                cur[:act] = table[cur[:act], codes[pos[:act] + step]]
+            result[order] = accepting[cur]
+            return result
+
+        # An NFA runs on the part of its subset DFA the words reach. A set of
+        # states gets a row the first time a word enters it, and a cell of that
+        # row is filled the first time a word leaves the set on that element.
+        if self._arrays is None:
+            self._arrays = [np.full((8, len(self.columns) + 1), -1, dtype=np.int32), [self.start], {self.start: 0}]
+        cur = np.zeros(len(words), dtype=np.int32)
+        for step in range(maxLen):
+            act = running[step]
+            cols = codes[pos[:act] + step]
+            nxt = self._arrays[0][cur[:act], cols]
+            missing = np.flatnonzero(nxt < 0)
+            if len(missing):
+                for row, col in np.unique(np.stack([cur[missing], cols[missing]]), axis=1).T:
+                    self._subset_move(int(row), int(col))
+                nxt[missing] = self._arrays[0][cur[missing], cols[missing]]
+            cur[:act] = nxt
+        sets = self._arrays[1]
+        accepting = np.array([bool(mask & self.finalMask) for mask in sets], dtype=bool)
+        result[order] = accepting[cur]
+        return result
+
+    def _move(self, cur: int, col: int) -> int:
+        """
+        :param cur: A set of states of an NFA, as a bitset.
+        :param col: The column of an element.
+        :return: The set of states cur moves to on the element.
+        """
+        moves = self.moves[col]
+        nxt = 0
+        while cur:
+            bit = cur & -cur
+            nxt |= moves[bit.bit_length() - 1]
+            cur ^= bit
+        return nxt
+
+    def _subset_move(self, row: int, col: int):
+        """
+        Fills in a cell of the subset DFA accepts_many runs an NFA on, adding a
+        row for the set of states moved to if it is new.
+        :param row: The row of a set of states.
+        :param col: The column of an element.
+        """
+        table, sets, rows = self._arrays
+        nxt = self._move(sets[row], col)
+        if nxt not in rows:
+            rows[nxt] = len(sets)
+            sets.append(nxt)
+            if len(sets) > len(table):
+                table = np.concatenate([table, np.full(table.shape, -1, dtype=np.int32)])
+                self._arrays[0] = table
+        table[row, col] = rows[nxt]
+
+
+class Thompson:
+    """
+    The transitions of a machine built by Machine.__add__, concat or KStar. Rather
+    than copying the transitions of its operands it only keeps a reference to
+    them, so composing is O(1) and sub-machines are shared by every expression
+    that uses them. The whole expression is flattened in one pass the first time
+    the machine is rendered or simulated.
+    """
+    __slots__ = ('op', 'operands')
+
+    UNION = '+'
+    CONCAT = 'concat'
+    STAR = 'KStar'
+
+    def __init__(self, op: str, *operands: 'Machine'):
+        """
+        :param op: One of Thompson.UNION, Thompson.CONCAT or Thompson.STAR.
+        :param operands: The machines composed; these should not be renamed later.
+        """
+        self.op = op
+        self.operands = operands
+
+    def __repr__(self) -> str:
+        # Operands are listed by name, printing them in full would repeat every
+        # shared sub-machine.
+        return f"Thompson({self.op!r}, {', '.join([repr(mach.name) for mach in self.operands])})"
+
+    def flatten(self, prefix: str) -> Automaton:
+        """
+        Builds the automaton of this expression in time linear in its size. A
+        sub-machine shared by several parts of the expression is only emitted once.
+        :param prefix: The prefix of the machine these are the transitions of.
+        :return: The automaton of the whole expression.
+        """
+        auto = Automaton(prefix)
+        done: set[tuple[int, str]] = set()
+        # The work stack holds either a transition (src, lab, dst) to add, or a
+        # (prefix, machine) whose transitions still have to be added under prefix.
+        # Using a stack rather than recursion keeps deep expressions from hitting
+        # the recursion limit.
+        work: list[tuple] = [(prefix, self)]
+        while work:
+            item = work.pop()
+            if len(item) == 3:
+                auto.add(*item)
+                continue
+            curPrefix, trans = item
+            if isinstance(trans, Machine):
+                # A sub-machine that is already flattened under the same prefix
+                # (a composition that was rendered or simulated before being
+                # composed further) is copied rather than walked again.
+                compiled = trans._compiled
+                if idx_2(trans.name) == curPrefix and (
+                        not isinstance(trans.transitions, (Thompson, Regex)) or
+                        compiled is not None and compiled.prefix == curPrefix):
+                    if (id(trans.transitions), curPrefix) not in done:
+                        done.add((id(trans.transitions), curPrefix))
+                        auto.extend(trans.automaton())
+                    continue
+                trans = trans.transitions
+            if (id(trans), curPrefix) in done:
+                continue
+            done.add((id(trans), curPrefix))
+            if not isinstance(trans, Thompson):
+                auto.extend(Automaton.from_transitions('', trans, prefix=curPrefix))
+                continue
+
+            q0 = STATES.intern(curPrefix, 0)
+            qf = STATES.intern(curPrefix, 'f')
+            finals = lambda mach, pre: [state_id(pre, acc) for acc in mach.accepting]
+            match trans.op, trans.operands:
+                case Thompson.UNION, (left, right):
+                    lPrefix, rPrefix = idx_2(left.name), idx_2(right.name)
+                    items = [(q0, EPS, STATES.intern(lPrefix, 0)),
+                             (q0, EPS, STATES.intern(rPrefix, 0)),
+                             (lPrefix, left), (rPrefix, right),
+                             *[(fin, EPS, qf) for fin in finals(right, rPrefix)],
+                             *[(fin, EPS, qf) for fin in finals(left, lPrefix)]]
+                case Thompson.CONCAT, (left, right):
+                    lPrefix, rPrefix = idx_2(left.name), idx_2(right.name)
+                    items = [(q0, EPS, STATES.intern(lPrefix, 0)),
+                             (lPrefix, left),
+                             *[(fin, EPS, STATES.intern(rPrefix, 0)) for fin in finals(left, lPrefix)],
+                             (rPrefix, right),
+                             *[(fin, EPS, qf) for fin in finals(right, rPrefix)]]
+                case Thompson.STAR, (inner,):
+                    # New start and final states around the operand: its own may
+                    # have moves in or out, so joining them directly would accept
+                    # words the star doesn't. An operand without a name of its own,
+                    # as in (M1 + M2).KStar(), is named after the star.
+                    iPrefix = idx_2(inner.name) if inner.name != 'Undefined' else curPrefix + "'"
+                    iStart = STATES.intern(iPrefix, 0)
+                    items = [(q0, EPS, iStart),
+                             (iPrefix, inner),
+                             *[(fin, EPS, iStart) for fin in finals(inner, iPrefix)],
+                             *[(fin, EPS, qf) for fin in finals(inner, iPrefix)],
+                             (q0, EPS, qf)]
+                case _:
+                    raise ValueError(f"Unrecognized composition {trans!r}.")
+            work.extend(reversed(items))
+        return auto
+
+
+_regexToken = re.compile(r"\\[A-Za-z]+|\S")
+
+
+class Regex:
+    """
+    A parsed regular expression: + is union, juxtaposition is concatenation, *
+    is the Kleene star and \\epsilon the empty string. A LaTeX command such as
+    \\sigma is a single element.
+
+    Nodes are hash-consed, so the same sub-expression is the same node wherever
+    it appears, and the Thompson construction of each node is only built once. It
+    is kept as a template whose states are named relative to the node and
+    renamed for every place the node is used: each place an operand is used in
+    it is a sub-machine numbered in preorder, and that number is the suffix of
+    its states. A suffix is as long as the sub-machine count's digits, rather
+    than growing with the depth of the expression. Parsing, printing and building templates use stacks rather
+    than recursion, so deeply nested expressions don't hit the recursion limit.
+    """
+    __slots__ = ('op', 'args', '_template', '__weakref__')
+
+    SYMBOL = 'symbol'
+    EPSILON = 'epsilon'
+    UNION = '+'
+    CONCAT = 'concat'
+    STAR = '*'
+
+    # The hash-consing table, entries go away with the last expression using them.
+    _nodes: 'weakref.WeakValueDictionary[tuple, Regex]' = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, op: str, args: tuple):
+        self.op = op
+        self.args = args
+        self._template = None
+
+    @classmethod
+    def node(cls, op: str, *args) -> 'Regex':
+        """
+        :return: The unique node for op applied to args.
+        """
+        key = (op, *args)
+        with cls._lock:
+            node = cls._nodes.get(key)
+            if node is None:
+                node = cls._nodes[key] = Regex(op, args)
+        return node
+
+    @classmethod
+    def balanced(cls, op: str, nodes: list['Regex']) -> 'Regex':
+        """
+        Joins nodes with the associative op as a balanced tree, which keeps the
+        state names of long unions and concatenations short.
+        """
+        while len(nodes) > 1:
+            nodes = [cls.node(op, *nodes[idx:idx + 2]) if idx + 1 < len(nodes) else nodes[idx]
+                     for idx in range(0, len(nodes), 2)]
+        return nodes[0]
+
+    @classmethod
+    def parse(cls, regex: str) -> 'Regex':
+        """
+        :param regex: The regular expression, e.g. '(a+bc)(a+b)*'.
+        :return: The root node of the expression.
+        """
+        tokens = _regexToken.findall(regex)
+        # One frame per open parenthesis (and one for the whole expression): the
+        # terms of its union so far and the factors of the term being read. A
+        # stack rather than recursion, so deep nesting can't hit the recursion limit.
+        frames: list[tuple[list[Regex], list[Regex]]] = [([], [])]
+        # Whether the last token ended a factor, which a * may follow.
+        starable = False
+        for pos, tok in enumerate(tokens):
+            terms, factors = frames[-1]
+            match tok:
+                case '*':
+                    if not starable:
+                        raise ValueError(f"Empty term at token {pos} of regular expression '{regex}'.")
+                    if factors[-1].op != cls.STAR:
+                        factors[-1] = cls.node(cls.STAR, factors[-1])
+                    continue
+                case '+' | ')':
+                    if not factors:
+                        raise ValueError(f"Empty term at token {pos} of regular expression '{regex}'.")
+                    terms.append(cls.balanced(cls.CONCAT, factors))
+                    if tok == '+':
+                        frames[-1] = (terms, [])
+                        starable = False
+                        continue
+                    if len(frames) == 1:
+                        raise ValueError(f"Unexpected ')' at token {pos} of regular expression '{regex}'.")
+                    frames.pop()
+                    frames[-1][1].append(cls.balanced(cls.UNION, terms))
+                case '(':
+                    frames.append(([], []))
+                    starable = False
+                    continue
+                case _ if tok == eps_ele:
+                    factors.append(cls.node(cls.EPSILON))
+                case _:
+                    factors.append(cls.node(cls.SYMBOL, tok))
+            starable = True
+        terms, factors = frames[-1]
+        if not factors:
+            raise ValueError(f"Empty term at token {len(tokens)} of regular expression '{regex}'.")
+        if len(frames) > 1:
+            raise ValueError(f"Missing ')' in regular expression '{regex}'.")
+        terms.append(cls.balanced(cls.CONCAT, factors))
+        return cls.balanced(cls.UNION, terms)
+
+    def __str__(self) -> str:
+        # Built bottom up with a stack, like template, so deep expressions print.
+        texts: dict[Regex, str] = dict()
+        work = [self]
+        while work:
+            node = work[-1]
+            pending = [arg for arg in node.args if isinstance(arg, Regex) and arg not in texts]
+            if pending:
+                work.extend(pending)
+                continue
+            work.pop()
+            args = [texts[arg] if isinstance(arg, Regex) else arg for arg in node.args]
+            match node.op:
+                case Regex.SYMBOL:
+                    texts[node] = args[0]
+                case Regex.EPSILON:
+                    texts[node] = eps_ele
+                case Regex.UNION:
+                    texts[node] = f"{args[0]}+{args[1]}"
+                case Regex.CONCAT:
+                    texts[node] = ''.join([f"({text})" if arg.op == Regex.UNION else text
+                                           for arg, text in zip(node.args, args)])
+                case Regex.STAR:
+                    texts[node] = f"{args[0]}*" if node.args[0].op == Regex.SYMBOL else f"({args[0]})*"
+        return texts[self]
+
+    def __repr__(self) -> str:
+        return f"Regex({str(self)!r})"
+
+    def __reduce__(self):
+        # Templates hold ids that only mean something in this process, so only
+        # the structure is pickled and the node is hash-consed again when it is
+        # unpickled. (The text would not do, parsing it can group differently.)
+        return Regex.node, (self.op, *self.args)
+
+    def template(self) -> tuple[list[tuple[str, int | str]], array.array, array.array, array.array]:
+        """
+        Returns this node's Thompson construction with states numbered locally.
+        The states list gives each local state as (prefix suffix, idx), with the
+        node's own start and final states always first; the arrays are src, lab
+        and dst over those local numbers.
+        """
+        gen = STATES.generation
+        if self._template is not None and self._template[0] == gen:
+            return self._template[1:]
+        states: list[tuple[str, int | str]] = []
+        src, lab, dst = array.array('l'), array.array('l'), array.array('l')
+
+        def add(*delta: int):
+            src.append(delta[0])
+            lab.append(delta[1])
+            dst.append(delta[2])
+
+        # Every place a node is used becomes a sub-machine with a start and a
+        # final state, numbered in preorder (this node is 0 and has no suffix).
+        # A star shares its operand's. The tree is walked with a stack, so deep
+        # expressions can't hit the recursion limit.
+        # Each use: the node, the local number of its start, and its operands' uses.
+        uses: list[tuple[Regex, int, list[int]]] = []
+        work: list[tuple[Regex, int | None]] = [(self, None)]
+        count = 0
+        while work:
+            node, parent = work.pop()
+            if parent is not None:
+                uses[parent][2].append(len(uses))
+            uses.append((node, len(states), []))
+            cached = node._template if node is not self else None
+            if cached is not None and cached[0] == gen:
+                # A template already built elsewhere is copied (below), its
+                # sub-machines are renumbered after this one's.
+                states.extend([(str(count + int(sfx or 0)) if count + int(sfx or 0) else '', idx)
+                               for sfx, idx in cached[1]])
+                count += len(cached[1]) // 2
+            elif node.op == Regex.STAR:
+                work.append((node.args[0], len(uses) - 1))
+            else:
+                sfx = str(count) if count else ''
+                states.extend([(sfx, 0), (sfx, 'f')])
+                count += 1
+                if node.op in (Regex.UNION, Regex.CONCAT):
+                    work.extend([(arg, len(uses) - 1) for arg in reversed(node.args)])
+
+        # The uses of a node's operands follow it in preorder, and a node's
+        # transitions come right before its operands', so the transitions of a
+        # node and its operands are contiguous and in the order of its template.
+        for node, start, operands in uses:
+            cached = node._template if node is not self else None
+            if cached is not None and cached[0] == gen:
+                src.extend([start + sid for sid in cached[2]])
+                lab.extend(cached[3])
+                dst.extend([start + sid for sid in cached[4]])
+                continue
+            match node.op:
+                case Regex.SYMBOL:
+                    add(start, SYMBOLS.intern(node.args[0]), start + 1)
+                case Regex.EPSILON:
+                    add(start, EPS, start + 1)
+                case Regex.UNION:
+                    left, right = [uses[num][1] for num in operands]
+                    add(start, EPS, left)
+                    add(start, EPS, right)
+                    add(right + 1, EPS, start + 1)
+                    add(left + 1, EPS, start + 1)
+                case Regex.CONCAT:
+                    left, right = [uses[num][1] for num in operands]
+                    add(start, EPS, left)
+                    add(left + 1, EPS, right)
+                    add(right + 1, EPS, start + 1)
+                case Regex.STAR:
+                    # The operand's start and final serve as this node's. That is
+                    # only sound because no other node's start has moves in or its
+                    # final moves out (and parse never stars a star).
+                    add(start + 1, EPS, start)
+                    add(start, EPS, start + 1)
+        self._template = (gen, states, src, lab, dst)
+        return self._template[1:]
+
+    def flatten(self, prefix: str) -> Automaton:
+        """
+        :param prefix: The prefix of the machine these are the transitions of.
+        :return: The automaton of this expression.
+        """
+        states, src, lab, dst = self.template()
+        ids = [STATES.intern(prefix + idx_2(sfx), idx) for sfx, idx in states]
+        auto = Automaton(prefix)
+        for sid in ids:
+            auto.add_state(sid)
+        auto.src = array.array('l', [ids[sid] for sid in src])
+        auto.lab = array.array('l', lab)
+        auto.dst = array.array('l', [ids[sid] for sid in dst])
+        return auto
+
+
+@dataclasses.dataclass
+class Machine:
+    name: str
+    transitions: transitions_type
+    # The accepting states, written as in the transitions.
+    accepting: acceptingType = ('f',)
+    # The interned form of this machine, built on first use.
+    _compiled: Automaton | None = dataclasses.field(default=None, init=False, repr=False, compare=False)
+    # The transitions and accepting states _compiled was built from, when they are
+    # lists that could be changed in place.
+    _source: tuple | None = dataclasses.field(default=None, init=False, repr=False, compare=False)
+    # Whether the transition list and automaton belong to this machine alone, so
+    # the edit methods can change them in place.
+    _editable: bool = dataclasses.field(default=False, init=False, repr=False, compare=False)
+    # While editable, the repr of each transition, for the representation comment.
+    _reprs: list[str] | None = dataclasses.field(default=None, init=False, repr=False, compare=False)
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+        if key in ('name', 'transitions', 'accepting'):
+            object.__setattr__(self, '_compiled', None)
+            object.__setattr__(self, '_editable', False)
+
+    def __repr__(self) -> str:
+        # accepting is only shown when it isn't the default, so the representation
+        # comment of a machine accepting at q_f is as it always was.
+        accepting = '' if list(self.accepting) == ['f'] else f", accepting={self.accepting!r}"
+        return f"Machine(name={self.name!r}, transitions={self.transitions!r}{accepting})"
+
+    def __getstate__(self) -> dict:
+        # The automaton is made of interned ids, which are only valid in this process.
+        state = self.__dict__.copy()
+        state['_compiled'] = state['_source'] = None
+        return state
+
+    def __current_source(self) -> tuple | None:
+        # Comparing with the tuples _compiled was built from only costs a pointer
+        # comparison per transition while nothing has changed.
+        if isinstance(self.transitions, list) or isinstance(self.accepting, list):
+            return tuple(self.transitions), tuple(self.accepting)
+        return None
+
+    def automaton(self) -> Automaton:
+        """
+        Returns the interned form of this machine. It is cached until the name or
+        the transitions are assigned again, or the transition or accepting lists
+        are changed in place. After an edit method has been used, the machine
+        should only be changed through the edit methods or by assignment.
+        :return: The automaton for this machine.
+        """
+        if self._compiled is not None and self._compiled.generation != STATES.generation:
+            # Built before reset_interning, the ids are no longer valid.
+            object.__setattr__(self, '_compiled', None)
+            object.__setattr__(self, '_editable', False)
+        elif self._editable:
+            if len(self.transitions) != len(self._reprs):
+                # The transition list was changed behind the edit methods' back.
+                object.__setattr__(self, '_compiled', None)
+                object.__setattr__(self, '_editable', False)
+        elif self._compiled is not None and self._source != self.__current_source():
+            object.__setattr__(self, '_compiled', None)
+        if self._compiled is None:
+            self._set_compiled(Automaton.from_transitions(self.name, self.transitions, accepting=self.accepting))
+        return self._compiled
+
+    def _set_compiled(self, auto: Automaton):
+        """
+        Caches auto as the automaton of this machine's current transitions.
+        """
+        object.__setattr__(self, '_source', self.__current_source())
+        object.__setattr__(self, '_compiled', auto)
+
+    @classmethod
+    def from_regex(cls, regex: str, name: str = 'Undefined') -> 'Machine':
+        """
+        Builds the machine of a regular expression under Thompson's Construction
+        Algorithm, instead of composing it by hand with +, concat and KStar.
+        Examples:
+            M = Machine.from_regex('(a+bc)(a+b)*', 'M')
+            M = Machine.from_regex('\\sigma\\tau*').setName('st')
+        :see: Regex
+        :param regex: The regular expression.
+        :param name: The name of the machine
+        :return: A new machine accepting the expression.
+        """
+        return Machine(name, Regex.parse(regex))
+
+    def determinize(self) -> 'Machine':
+        """
+        Converts this (ε-)NFA into a DFA by the subset construction.
+        Examples:
+            D = Machine.from_regex('(a+bc)(a+b)*', 'D').determinize()
+        :see: Automaton.determinize
+        :return: A new deterministic machine with the same name and language.
+        """
+        return self.automaton().determinize().to_machine(self.name)
+
+    def minimize(self) -> 'Machine':
+        """
+        Returns the minimal DFA of this machine (determinizing it first if needed).
+        Examples:
+            M = Machine.from_regex('(a+b)*a(a+b)', 'M').minimize()
+        :see: Automaton.minimize
+        :return: A new minimal deterministic machine with the same name and language.
+        """
+        return self.automaton().minimize().to_machine(self.name)
+
+    def accepts(self, word: wordType) -> bool:
+        """
+        :param word: The input, a str of single character elements or a sequence of elements.
+        :return: Whether this machine accepts the word.
+        """
+        return self.automaton().simulation().accepts(word)
+
+    def accepts_many(self, words: typing.Iterable[wordType]) -> 'np.ndarray':
+        """
+        Checks a whole batch of words at once, see Simulation.
+        Examples:
+            M = Machine.from_regex('(a+bc)(a+b)*', 'M').determinize()
+            M.accepts_many(['abab', 'bcb', 'c'])  # [True, True, False]
+        :param words: The input.
+        :return: A bool array, whether this machine accepts each word.
+        """
+        return self.automaton().simulation().accepts_many(words)
+
+    def trim(self) -> 'Machine':
+        """
+        Removes the states that can't be reached from q0 or can't reach an
+        accepting state, such as those Thompson's Construction leaves behind.
+        :see: Automaton.trim
+        :return: A new machine with the same name and language.
+        """
+        return self.automaton().trim().to_machine(self.name)
+
+    def remove_epsilons(self) -> 'Machine':
+        """
+        Removes the ε transitions (and the states only they reached).
+        Examples:
+            M = (Machine('a', 'a') + Machine('b', 'b')).setName('c').remove_epsilons()
+        :see: Automaton.remove_epsilons
+        :return: A new machine with the same name and language and no ε transitions.
+        """
+        return self.automaton().remove_epsilons().trim().to_machine(self.name)
+
+    def intersect(self, other: 'Machine') -> 'Machine':
+        """
+        This performs FSA intersection by the product construction.
+        Examples:
+            M = Machine.from_regex('(a+b)*a', 'M').intersect(Machine.from_regex('a*', 'N')).setName('MN')
+        :see: Automaton.product
+        :param other: The other machine to intersect with this machine.
+        :return: A new deterministic machine accepting the words both machines accept.
+        """
+        return self.automaton().product(other.automaton(), Automaton.INTERSECT,
+                                        idx_2('Undefined')).to_machine('Undefined')
+
+    def difference(self, other: 'Machine') -> 'Machine':
+        """
+        This performs FSA difference by the product construction, for instance a
+        student's machine minus the reference machine gives the words the student
+        wrongly accepts.
+        :see: Automaton.product
+        :param other: The machine whose words are removed.
+        :return: A new deterministic machine accepting the words this machine
+            accepts and other does not.
+        """
+        return self.automaton().product(other.automaton(), Automaton.DIFFERENCE,
+                                        idx_2('Undefined')).to_machine('Undefined')
+
+    def complement(self, sigma: typing.Iterable[str] = ()) -> 'Machine':
+        """
+        :see: Automaton.complement
+        :param sigma: Elements of Σ besides the ones this machine uses.
+        :return: A new deterministic machine accepting the words over Σ this machine rejects.
+        """
+        return self.automaton().complement(sigma, idx_2('Undefined')).to_machine('Undefined')
+
+    def equivalent(self, other: 'Machine') -> Equivalence:
+        """
+        Checks whether this machine accepts the same language as other, without
+        minimizing either of them.
+        Examples:
+            Machine.from_regex('(a+b)*', 'M').equivalent(Machine.from_regex('(a*b*)*', 'N'))  # true
+            Machine.from_regex('a*', 'M').equivalent(Machine.from_regex('aa*', 'N')).counterexample  # ''
+        :see: Automaton.counterexample
+        :param other: The machine to compare with.
+        :return: Whether they are equivalent, with a shortest word telling them apart if not.
+        """
+        word = self.automaton().counterexample(other.automaton())
+        if word is None:
+            return Equivalence(True)
+        eles = [SYMBOLS.names[ele] for ele in word]
+        return Equivalence(False, ''.join(eles) if all([len(ele) == 1 for ele in eles]) else tuple(eles))
+
+    def count_words(self, n: int, exact: bool = False) -> int:
+        """
+        Examples:
+            Machine.from_regex('(a+b)*', 'M').count_words(3)  # 15 = 1 + 2 + 4 + 8
+            Machine.from_regex('(a+b)*', 'M').count_words(300, exact=True)  # 2**300
+        :see: Automaton.count_words
+        :param n: The length of the words.
+        :param exact: Only count words of length n, rather than of length up to n.
+        :return: How many words this machine accepts.
+        """
+        return self.automaton().count_words(n, exact)
+
+    def iter_words(self, maxLen: int) -> typing.Iterator[wordType]:
+        """
+        Lazily lists the accepted words of length up to maxLen in shortlex order.
+        Examples:
+            list(Machine.from_regex('a(b+c)*', 'M').iter_words(2))  # ['a', 'ab', 'ac']
+        :see: Automaton.iter_words
+        :param maxLen: The longest words wanted.
+        :return: Each word, as a str when every element is a single character,
+            otherwise as a tuple of elements.
+        """
+        auto = self.automaton()
+        names = SYMBOLS.names
+        if all([len(names[ele]) == 1 for ele in auto.sigma() if ele != EPS]):
+            return (''.join([names[ele] for ele in word]) for word in auto.iter_words(maxLen))
+        return (tuple([names[ele] for ele in word]) for word in auto.iter_words(maxLen))
+
+    def to_mermaid(self, out: typing.TextIO | None = None) -> str | None:
+        """
+        Exports this machine as a Mermaid flowchart, styled as sketched at the top
+        of this file.
+        :see: Automaton.write_mermaid
+        :param out: Where to write the flowchart, by default it is returned.
+        :return: The flowchart, or None when it was written to out.
+        """
+        return self.__export(self.automaton().write_mermaid, out)
+
+    def to_dot(self, out: typing.TextIO | None = None) -> str | None:
+        """
+        Exports this machine as a Graphviz digraph.
+        :see: Automaton.write_dot
+        :param out: Where to write the digraph, by default it is returned.
+        :return: The digraph, or None when it was written to out.
+        """
+        return self.__export(lambda sink: self.automaton().write_dot(sink, self.name), out)
+
+    @staticmethod
+    def __export(write: typing.Callable[[typing.TextIO], None], out: typing.TextIO | None) -> str | None:
+        if out is not None:
+            write(out)
+            return None
+        buffer = io.StringIO()
+        write(buffer)
+        return buffer.getvalue()
+
+    def __editable(self) -> Automaton:
+        """
+        Makes the transitions a list and the automaton this machine's own (copying
+        them the first time, as they may be shared with compositions or snapshots).
+        :return: The automaton to edit.
+        """
+        if not self._editable:
+            auto = self.automaton().copy()
+            if isinstance(self.transitions, list):
+                transitions, accepting = list(self.transitions), self.accepting
+            else:
+                # A composition, regular expression or single element is written out.
+                mach = auto.to_machine(self.name)
+                transitions, accepting = mach.transitions, mach.accepting
+            object.__setattr__(self, 'transitions', transitions)
+            object.__setattr__(self, 'accepting', tuple(accepting))
+            object.__setattr__(self, '_compiled', auto)
+            object.__setattr__(self, '_reprs', [repr(delta) for delta in transitions])
+            object.__setattr__(self, '_editable', True)
+        return self._compiled
+
+    def __state_id(self, possIdx: int | str) -> int:
+        return state_id(idx_2(self.name), possIdx)
+
+    def add_transition(self, fromState: int | str, on: 'onType', toState: int | str) -> 'Machine':
+        """
+        Adds a transition in place. The automaton and its views (states, sorted
+        states, transition positions, rendered δ rows) are updated rather than
+        rebuilt, so printing the machine again only renders the row of fromState.
+        Examples:
+            M = Machine('M', [(0, 'a', 1)]).add_transition(1, 'b', 'f')
+        :param fromState: As written in the transitions, e.g. 0, 1 or 'f'.
+        :param on: The element(s).
+        :param toState: As written in the transitions.
+        :return: This machine.
+        """
+        src, dst = self.__state_id(fromState), self.__state_id(toState)
+        auto = self.__editable()
+        auto.add(src, SYMBOLS.intern(on), dst)
+        auto.mark(fromState, src)
+        auto.mark(toState, dst)
+        self.transitions.append((fromState, on, toState))
+        self._reprs.append(repr(self.transitions[-1]))
+        return self
+
+    def remove_transition(self, fromState: int | str, on: 'onType', toState: int | str) -> 'Machine':
+        """
+        Removes a transition in place (the first one, if it was added twice), see
+        add_transition. The last transition in the list takes its place. States
+        left without transitions are removed.
+        :return: This machine.
+        """
+        src, lab, dst = self.__state_id(fromState), SYMBOLS.intern(on), self.__state_id(toState)
+        # The transition list and the automaton hold the transitions in the same
+        # order, so the automaton's position index finds it in both.
+        pos = self.__editable().remove(src, lab, dst)
+        for held in (self.transitions, self._reprs):
+            last = held.pop()
+            if pos < len(held):
+                held[pos] = last
+        return self
+
+    def rename_state(self, old: int | str, new: int | str) -> 'Machine':
+        """
+        Renames a state in place, in the transitions and the accepting states.
+        Only the transitions of old are rewritten, and only the rows of old and
+        of the states moving to it are rendered again.
+        Examples:
+            M = Machine('M', [(0, 'a', 1), (1, 'b', 'f')]).rename_state(1, 5)
+        :param old: A state other than 0, as written in the transitions.
+        :param new: A state not in the machine yet.
+        :return: This machine.
+        """
+        oldId, newId = self.__state_id(old), self.__state_id(new)
+        auto = self.__editable()
+        written = new if STATES.prefixes[newId] == idx_2(self.name) else STATES.name(newId)
+        for pos in auto.rename(oldId, newId):
+            src, dst = auto.src[pos], auto.dst[pos]
+            match self.transitions[pos]:
+                case (fromIdx, on, toIdx):
+                    self.transitions[pos] = (written if src == newId else fromIdx, on,
+                                             written if dst == newId else toIdx)
+                case Delta() as delta:
+                    self.transitions[pos] = Delta(STATES.name(newId) if src == newId else delta.fromState,
+                                                  delta.on,
+                                                  STATES.name(newId) if dst == newId else delta.toState)
+            self._reprs[pos] = repr(self.transitions[pos])
+        object.__setattr__(self, 'accepting', tuple([written if self.__state_id(acc) == oldId else acc
+                                                     for acc in self.accepting]))
+        return self
+
+    def save(self, path: str | os.PathLike):
+        """
+        Saves this machine to a binary archive of its own.
+        :see: save_machines
+        :param path: The archive, replaced if it exists.
+        """
+        save_machines(path, [self])
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, which: int | str = 0) -> 'Machine':
+        """
+        Loads a machine saved by save (or one of many saved by save_machines).
+        Examples:
+            M.save('M.fsa')
+            M2 = Machine.load('M.fsa')
+        :see: MachineArchive
+        :param which: The position or the name of the machine in the archive.
+        :return: The machine, with its states written by idx.
+        """
+        with MachineArchive(path) as archive:
+            return archive[which]
+
+    def __str__(self) -> str:
+        if RENDER_PASSES:
+            return getMachineStr(self.name, self.transitions, self.accepting)
+        # The cached automaton is rendered, so after an edit only the rows it
+        # changed are rendered again.
+        check_named(self.name)
+        auto = self.automaton()
+        representation = None
+        if self._editable:
+            # The same as repr([name, transitions]), without a repr of every transition.
+            representation = f"[{self.name!r}, [{', '.join(self._reprs)}]]"
+        return ''.join(_render(self.name, self.transitions, auto, representation)[0])
 
     def setName(self, name: str) -> 'Machine':
         """
@@ -346,6 +2842,20 @@ flowchart LR
         self.name = name
         return self
 
+    def __snapshot(self) -> 'Machine':
+        """
+        :return: A copy of this machine sharing its transitions and cached
+            automaton, so renaming this machine later can't change a composition.
+        """
+        snap = Machine(self.name, self.transitions, self.accepting)
+        if self._editable:
+            # Both now share the transitions, an edit of this machine must copy them.
+            self._set_compiled(self._compiled)
+            object.__setattr__(self, '_editable', False)
+        object.__setattr__(snap, '_compiled', self._compiled)
+        object.__setattr__(snap, '_source', self._source)
+        return snap
+
     def __add__(self, other: 'Machine') -> 'Machine':
         """
         This performs FSA union under Thompson's Construction Algorithm.
@@ -355,13 +2865,7 @@ flowchart LR
         # This is a union. Return a machine with a new init state with ε
         # transitions to my and other init states. Add a new final state that
         # has ε transitions from my and other final states.
-        return Machine('Undefined', [
-                (0, eps_ele, state_2norm(self.name, 0)),
-                (0, eps_ele, state_2norm(other.name, 0)),
-                *self.__normalize().transitions, *other.__normalize().transitions,
-                (state_2norm(other.name, 'f'), eps_ele, 'f'),
-                (state_2norm(self.name, 'f'), eps_ele, 'f')
-        ])
+        return Machine('Undefined', Thompson(Thompson.UNION, self.__snapshot(), other.__snapshot()))
 
     def concat(self, other: 'Machine') -> 'Machine':
         """
@@ -373,13 +2877,7 @@ flowchart LR
         # transitions to my init state. Add a transition from my final to other
         # init state.  Add a new final state that
         # has ε transition from other final state.
-        return Machine('Undefined', [
-                (0, eps_ele, state_2norm(self.name, 0)),
-                *self.__normalize().transitions,
-                (state_2norm(self.name, 'f'), eps_ele, state_2(other.name, '0')),
-                *other.__normalize().transitions,
-                (state_2norm(other.name, 'f'), eps_ele, 'f')
-        ])
+        return Machine('Undefined', Thompson(Thompson.CONCAT, self.__snapshot(), other.__snapshot()))
 
     def KStar(self) -> 'Machine':
         """
@@ -387,85 +2885,628 @@ flowchart LR
         :param other: The other machine to union with this machine.
         :return: A new machine constructed as per Thompson's Construction Algorithm.
         """
-        # This is a Kleene star. Technically there should be new start and a single
-        # accepting state added, but as these are constructed with only single start
-        # and end states it would be superfluous. Return a machine with a new  ε
-        # transition from my final state to my init state.
-        return Machine(self.name + "'", [
-                *self.transitions,
-                ('f', eps_ele, 0)
-        ])
-
-
-def getMachine(name: str, transitions: transitions_type) -> tuple[str, Machine]:
-    assert name != 'Undefined'
-    states: set[str] = set[str]()
-    deltasTable: list[Delta] = []
-    prefix = idx_2(name)
-    match transitions:
-        # Determine which type of transition it is and handle it.
-        case [*deltas]:
-            for delta in deltas:
-                match delta:
-                    case (fromIdx, onType as on, toIdx):
-                        def match_to_state(possIdx: int | str) -> str:
-                            match possIdx:
-                                case '0' | 'f' | int(_):
-                                    # Add my prefix and create a state.
-                                    return state(prefix, possIdx)
-                                case str():
-                                    # This is already a fully formatted state.
-                                    return possIdx
-                                case _:
-                                    raise ValueError(f"Unrecognized transition element {possIdx} in transition {delta}")
-
-                        states.add(fromName := match_to_state(fromIdx))
-                        states.add(toName := match_to_state(toIdx))
-                        deltasTable.append(Delta(fromName, on, toName))
-                    case transition if isinstance(transition, Delta):
-                        states.add(transition.fromState)
-                        states.add(transition.toState)
-                        deltasTable.append(transition)
-                    case _:
-                        raise ValueError(f"No match found for {delta}.")
-        case str(on):
-            states.add(fromName := state(prefix, 0))
-            states.add(toName := state(prefix, 'f'))
-            deltasTable.append(Delta(fromName, on, toName))
-        case _:
-            raise ValueError(f"No match found for {transitions}.")
-    xlist = ', '.join([str(delta) for delta in deltasTable])
-
-    curMach = Machine(name, deltasTable)
-    match len(states):
-        case int(1 | 2):
-            return (shortMachTemplate.substitute(representation=repr([name, transitions]),
-                                                 name=prefix,
-                                                 states=', '.join(State.sort_list(states)),
-                                                 transitions=xlist,
-                                                 q0=state(prefix, 0),
-                                                 qf=state(prefix, 'f')), curMach)
+        # This is a Kleene star. Return a machine with a new init state and a new
+        # final state, with ε transitions from the new init state to my init state
+        # and to the new final state, and from my final state back to my init
+        # state and on to the new final state.
+        return Machine(self.name + "'", Thompson(Thompson.STAR, self.__snapshot()))
+
+
+machTemplates: dict[string.Template, tuple[string.Template, string.Template]] = dict(
+        [(template, split_template(template, 'transitions'))
+         for template in (shortMachTemplate, machTemplate, longMachTemplate)])
+
+
+def pick_template(auto: Automaton) -> string.Template:
+    """
+    :return: The machine template used to render auto, chosen by its number of states.
+    """
+    match len(auto.states):
+        case int(0 | 1 | 2):
+            return shortMachTemplate
         case int(3 | 4):
-            return (machTemplate.substitute(representation=repr(curMach),
-                                            name=prefix,
-                                            states=', '.join(State.sort_list(states)),
-                                            transitions=Delta.deltas_to_table(deltasTable, prefix),
-                                            q0=state(prefix, 0),
-                                            qf=state(prefix, 'f')), curMach)
+            return machTemplate
+        case _:
+            return longMachTemplate
+
+
+def build_automaton(name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+                    passes: passesType = None) -> Automaton:
+    """
+    :param passes: Run on the automaton in order, by default RENDER_PASSES.
+    :return: The automaton getMachine renders.
+    """
+    auto = Automaton.from_transitions(name, transitions, accepting=accepting)
+    for stage in (RENDER_PASSES if passes is None else passes):
+        auto = stage(auto)
+    return auto
+
+
+def check_named(name: str):
+    """
+    :raise ValueError: If name is the placeholder a composition gets. Its states
+        would be named after 'Undefined', so it must be named with setName first.
+    """
+    if name == 'Undefined':
+        raise ValueError("A composed machine must be named with setName before it is rendered.")
 
+
+def renderMachine(name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+                  cache: 'RenderCache | None' = None, passes: passesType = None
+                  ) -> tuple[typing.Iterator[str], Machine]:
+    """
+    Like getMachine, but the LaTeX comes in pieces (TABLE_CHUNK_ROWS δ table
+    rows each) as it is rendered, so a long machine can be written out without
+    building it as one string. Errors in the transitions are raised here, not while iterating.
+    :param cache: Where to look up and store the rendered machine.
+    :param passes: Run on the machine before its template is chosen, by default
+        RENDER_PASSES. SIMPLIFY_PASSES removes ε transitions and useless states.
+    :return: The pieces of the LaTeX and the machine as Delta transitions.
+    """
+    check_named(name)
+    accepting = tuple(accepting)
+    passes = tuple(RENDER_PASSES if passes is None else passes)
+    prof = PROFILER
+    if prof is not None:
+        prof.machine = name
+        start = prof.begin()
+    auto = build_automaton(name, transitions, accepting, passes)
+    if prof is not None:
+        prof.end('normalize', start, name)
+    if cache is not None:
+        key = cache.key(name, transitions, accepting, auto, passes)
+        hit = cache.get(key)
+        if hit is not None:
+            return iter([hit[0]]), hit[1]
+        (pieces, curMach) = _render(name, transitions, auto)
+
+        def storing() -> typing.Iterator[str]:
+            done = []
+            for piece in pieces:
+                done.append(piece)
+                yield piece
+            cache.put(key, ''.join(done), curMach)
+
+        return storing(), curMach
+    return _render(name, transitions, auto)
+
+
+def _delta_machine(name: str, auto: Automaton) -> Machine:
+    # The machine getMachine returns, with all transitions as Delta instances.
+    curMach = Machine(name, auto.to_deltas(),
+                      ('f',) if auto.finals == [auto.final] else [STATES.name(sid) for sid in auto.finals])
+    curMach._set_compiled(auto)
+    return curMach
+
+
+def _representation(name: str, transitions: transitions_type, auto: Automaton) -> str:
+    # What the $representation comment records. A composition or a regular
+    # expression is written out as the transitions it flattens to, so the
+    # comment still holds the whole machine.
+    if isinstance(transitions, (Thompson, Regex)):
+        transitions = auto.written()
+    return repr([name, transitions])
+
+
+def _render(name: str, transitions: transitions_type, auto: Automaton,
+            representation: str | None = None) -> tuple[typing.Iterator[str], Machine]:
+    # representation is the $representation comment, if the caller already has it.
+    prof = PROFILER
+    if prof is not None:
+        start = prof.begin()
+    prefix = auto.prefix
+    curMach = _delta_machine(name, auto)
+    deltasTable = curMach.transitions
+    if prof is not None:
+        prof.end('deltas', start, name)
+        start = prof.begin()
+    auto.sorted_states()
+    if prof is not None:
+        prof.end('sort_list', start, name)
+        start = prof.begin()
+    fields = dict(name=prefix,
+                  states=auto.state_list(),
+                  q0=state(prefix, 0),
+                  qf=', '.join([STATES.name(sid) for sid in sorted(auto.finals, key=STATES.keys.__getitem__)]))
+    if prof is not None:
+        prof.end('states', start, name)
+    template = pick_template(auto)
+    match template:
+        case _ if template is shortMachTemplate:
+            fields['representation'] = representation or _representation(name, transitions, auto)
+            body = lambda: iter([', '.join([str(delta) for delta in deltasTable])])
+        case _ if template is machTemplate:
+            fields['representation'] = repr(curMach)
+            body = auto.iter_table
         case _:
-            return (longMachTemplate.substitute(representation=repr([name, transitions]),
-                                                name=prefix,
-                                                states=', '.join(State.sort_list(states)),
-                                                transitions=Delta.deltas_to_table(deltasTable, prefix),
-                                                q0=state(prefix, 0),
-                                                qf=state(prefix, 'f')), curMach)
+            fields['representation'] = representation or _representation(name, transitions, auto)
+            body = auto.iter_table
+
+    def pieces() -> typing.Iterator[str]:
+        head, tail = machTemplates[template]
+        if prof is None:
+            yield head.substitute(fields)
+            yield from body()
+            yield tail.substitute(fields)
+            return
+        # The same, timing each stage but not the time spent by the consumer.
+        # Both substitutions are done up front so they are recorded once.
+        start = prof.begin()
+        texts = head.substitute(fields), tail.substitute(fields)
+        prof.end('substitute', start, name)
+        yield texts[0]
+        yield from prof.timed('deltas_to_table', body(), name)
+        yield texts[1]
+
+    return pieces(), curMach
+
 
-    # return (strResult, Machine(name, deltasTable))
+def getMachine(name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+               cache: 'RenderCache | None' = None, passes: passesType = None) -> tuple[str, Machine]:
+    (pieces, curMach) = renderMachine(name, transitions, accepting, cache, passes)
+    return ''.join(pieces), curMach
 
 
-def getMachineStr(name: str, transitions: transitions_type) -> str:
-    return getMachine(name, transitions)[0]
+def getMachineStr(name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+                  cache: 'RenderCache | None' = None, passes: passesType = None) -> str:
+    return getMachine(name, transitions, accepting, cache, passes)[0]
+
+
+class RenderCache:
+    """
+    An on-disk cache of rendered machines, so a document build only renders the
+    machines that changed. Entries are keyed by a hash of everything the LaTeX
+    depends on: the name, the transitions as written (they appear in the
+    representation comment), the transitions once flattened and normalized, the
+    accepting states, the template chosen (and the text of the templates) and
+    TRIM_COMPOSED_ACC_STATES. Each entry is a JSON file holding the LaTeX and the
+    Delta transitions and accepting states of the machine getMachine returns, so
+    reading a cache shared with others runs no code from it. An entry that can't
+    be read or decoded is a miss. When the files take up more than maxBytes the
+    least recently used ones are removed.
+    Examples:
+        cache = RenderCache('.fsa-cache')
+        latex = getMachineStr('a', 'a', cache=cache)
+        print(cache.report())
+    """
+    SUFFIX = '.fsa'
+    # Raised whenever the same machine starts rendering differently, so entries
+    # rendered by older code are not reused.
+    FORMAT = 2
+
+    def __init__(self, directory: str | os.PathLike, maxBytes: int = 64 * 1024 * 1024):
+        """
+        :param directory: Where the entries are kept, created if needed.
+        :param maxBytes: How much the entries may take up on disk.
+        """
+        self.directory = os.fspath(directory)
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # key -> size, least recently used first. Recency survives between runs
+        # through the files' modification times.
+        self._sizes: dict[str, int] = dict()
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(self.SUFFIX)]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime_ns):
+            self._sizes[entry.name[:-len(self.SUFFIX)]] = entry.stat().st_size
+        self._size = sum(self._sizes.values())
+        self._evict()
+        version = hashlib.sha256(str(self.FORMAT).encode())
+        for template in (shortMachTemplate, machTemplate, longMachTemplate, tableTemplate):
+            version.update(template.template.encode())
+        self._version = version.digest()
+
+    def key(self, name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+            auto: Automaton | None = None, passes: passesType = None) -> str:
+        """
+        :param auto: The automaton of the machine (after the passes), if it was already built.
+        :return: The key of the machine getMachine(name, transitions, accepting, passes=passes) renders.
+        """
+        return _render_key(self._version, name, transitions, accepting, auto, passes)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> tuple[str, Machine] | None:
+        """
+        :return: The LaTeX and machine stored under key, or None on a miss.
+        """
+        with self._lock:
+            if key in self._sizes:
+                try:
+                    with open(self.path(key), 'rb') as entry:
+                        hit = self._decode(json.load(entry))
+                    os.utime(self.path(key))
+                    self._sizes[key] = self._sizes.pop(key)
+                    self.hits += 1
+                    return hit
+                except (OSError, ValueError, TypeError, KeyError):
+                    # Removed or corrupted by someone else, render it again.
+                    self._size -= self._sizes.pop(key)
+            self.misses += 1
+            return None
+
+    @staticmethod
+    def _decode(entry: dict) -> tuple[str, Machine]:
+        # Raises ValueError, TypeError or KeyError unless entry is as put wrote it.
+        name, latex = entry['name'], entry['latex']
+        if not isinstance(name, str) or not isinstance(latex, str) or name == 'Undefined':
+            raise ValueError("Not a cache entry.")
+        deltas = [Delta(fromState, on, toState) for fromState, on, toState in entry['transitions']]
+        accepting = entry['accepting']
+        if not all([isinstance(field, str) for delta in deltas for field in dataclasses.astuple(delta)] +
+                   [isinstance(acc, str) for acc in accepting]):
+            raise ValueError("Not a cache entry.")
+        return latex, Machine(name, deltas, accepting)
+
+    def put(self, key: str, latex: str, curMach: Machine):
+        """
+        Stores an entry, then evicts the least recently used ones while over maxBytes.
+        :param curMach: The machine getMachine returns for it.
+        """
+        data = json.dumps(dict(name=curMach.name, latex=latex,
+                               transitions=[dataclasses.astuple(delta) for delta in curMach.transitions],
+                               accepting=list(curMach.accepting))).encode()
+        with self._lock:
+            # Write then rename so a reader never sees half an entry.
+            tmp = self.path(key) + f".{os.getpid()}.tmp"
+            with open(tmp, 'wb') as entry:
+                entry.write(data)
+            os.replace(tmp, self.path(key))
+            self._size += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # Removes the least recently used entries (but never the newest) until
+        # the cache fits in maxBytes.
+        while self._size > self.maxBytes and len(self._sizes) > 1:
+            oldest = next(iter(self._sizes))
+            self._size -= self._sizes.pop(oldest)
+            self.evictions += 1
+            try:
+                os.remove(self.path(oldest))
+            except OSError:
+                pass
+
+    def report(self) -> str:
+        """
+        :return: A one line summary of the hits, misses and evictions so far.
+        """
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        return (f"render cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.evictions} evicted, {len(self._sizes)} entries, {self._size} bytes")
+
+
+ARCHIVE_MAGIC = b'FSAR'
+ARCHIVE_VERSION = 1
+
+
+def save_machines(path: str | os.PathLike, machines: typing.Iterable[Machine]):
+    """
+    Saves machines to a binary archive, read back with MachineArchive.
+
+    The archive is little endian: a header (magic 'FSAR', version, number of
+    machines) with the u64 offset of every record, then the records. A record
+    is self-contained: nine u32 counts and string ids (states, symbols,
+    transitions, accepting states, strings, string bytes, name, prefix, marked
+    states) and a u32 of padding, then its arrays, each starting on an 8 byte
+    boundary:
+        string offsets u32[strings + 1], string bytes (utf-8),
+        state prefixes i32[states] (a string id, -1 for a state not in the standard format),
+        state idxs i64[states] (an int idx, or -1 - the string id of a str idx),
+        symbols i32[symbols] (string ids of the labels),
+        CSR transitions: rowPtr u32[states + 1], lab u32[transitions], dst u32[transitions],
+        accepting u32[accepting],
+        marked u32[marked] (the states marked \\ACC, see Automaton.mark).
+    States are numbered in the order the automaton first saw them, and the
+    transitions of each state keep their order.
+    :param path: The archive, replaced if it exists.
+    :param machines: The machines to save.
+    """
+    require_numpy()
+    machines = list(machines)
+    tmp = os.fspath(path) + f".{os.getpid()}.tmp"
+    with open(tmp, 'wb') as out:
+        out.write(ARCHIVE_MAGIC + np.array([ARCHIVE_VERSION, len(machines), 0], dtype='<u4').tobytes())
+        offsetsAt = out.tell()
+        out.write(bytes(8 * (len(machines) + 1)))
+        offsets = []
+        for mach in machines:
+            offsets.append(out.tell())
+            out.write(_encode_record(mach))
+        offsets.append(out.tell())
+        out.seek(offsetsAt)
+        out.write(np.array(offsets, dtype='<u8').tobytes())
+    os.replace(tmp, path)
+
+
+def _encode_record(mach: Machine) -> bytes:
+    auto = mach.automaton()
+    local = auto.numbering()
+    strings: dict[str, int] = dict()
+    string = lambda text: strings.setdefault(text, len(strings))
+    name, prefix = string(mach.name), string(auto.prefix)
+    prefixes = [string(STATES.prefixes[sid]) if STATES.prefixes[sid] is not None else -1 for sid in local]
+    idxs = [STATES.idxs[sid] if isinstance(STATES.idxs[sid], int) else -1 - string(STATES.idxs[sid])
+            for sid in local]
+    symbols: dict[int, int] = dict()
+    # A counting sort of the transitions by source, stable so each state's keep their order.
+    rowPtr = [0] * (len(local) + 1)
+    for src in auto.src:
+        rowPtr[local[src] + 1] += 1
+    for num in range(len(local)):
+        rowPtr[num + 1] += rowPtr[num]
+    fill = rowPtr[:-1]
+    labs = [0] * len(auto)
+    dsts = [0] * len(auto)
+    for src, lab, dst in zip(auto.src, auto.lab, auto.dst):
+        pos = fill[local[src]]
+        fill[local[src]] += 1
+        labs[pos] = symbols.setdefault(lab, len(symbols))
+        dsts[pos] = local[dst]
+    symbolNames = [string(SYMBOLS.names[lab]) for lab in symbols]
+    finals = [local[sid] for sid in auto.finals if sid in local]
+    marked = [local[sid] for sid in auto.marked if sid in local]
+    encoded = [text.encode() for text in strings]
+    strOffsets = [0]
+    for data in encoded:
+        strOffsets.append(strOffsets[-1] + len(data))
+
+    parts = [np.array([len(local), len(symbols), len(auto), len(finals), len(strings), strOffsets[-1],
+                       name, prefix, len(marked), 0], dtype='<u4').tobytes()]
+    for values, dtype in ((strOffsets, '<u4'), (b''.join(encoded), None), (prefixes, '<i4'), (idxs, '<i8'),
+                          (symbolNames, '<i4'), (rowPtr, '<u4'), (labs, '<u4'), (dsts, '<u4'), (finals, '<u4'),
+                          (marked, '<u4')):
+        data = values if dtype is None else np.array(values, dtype=dtype).tobytes()
+        parts.append(data + bytes(-len(data) % 8))
+    return b''.join(parts)
+
+
+@dataclasses.dataclass(frozen=True)
+class MachineRecord:
+    """
+    A machine in a MachineArchive, as numpy views of the mapped file (no copies).
+    See save_machines for what the arrays hold.
+    """
+    name: str
+    prefix: str
+    strings: typing.Callable[[int], str]
+    statePrefixes: 'np.ndarray'
+    stateIdxs: 'np.ndarray'
+    symbols: 'np.ndarray'
+    rowPtr: 'np.ndarray'
+    lab: 'np.ndarray'
+    dst: 'np.ndarray'
+    finals: 'np.ndarray'
+    marked: 'np.ndarray'
+
+    def automaton(self) -> Automaton:
+        """
+        :return: The machine's automaton, interning only this record's states and symbols.
+        """
+        string = self.strings
+        sids = [STATES.intern(string(prefix) if prefix >= 0 else None, idx if idx >= 0 else string(-1 - idx))
+                for prefix, idx in zip(self.statePrefixes.tolist(), self.stateIdxs.tolist())]
+        labs = [SYMBOLS.intern(string(name)) for name in self.symbols.tolist()]
+        auto = Automaton(self.prefix, [sids[num] for num in self.finals.tolist()])
+        auto.marked.update([sids[num] for num in self.marked.tolist()])
+        for sid in sids:
+            auto.add_state(sid)
+        rowPtr, lab, dst = self.rowPtr.tolist(), self.lab.tolist(), self.dst.tolist()
+        for num, sid in enumerate(sids):
+            for pos in range(rowPtr[num], rowPtr[num + 1]):
+                auto.add(sid, labs[lab[pos]], sids[dst[pos]])
+        return auto
+
+    def machine(self) -> Machine:
+        """
+        :return: The machine, with its states written by idx (see Automaton.to_machine).
+        """
+        return self.automaton().to_machine(self.name)
+
+
+class MachineArchive:
+    """
+    An archive written by save_machines, opened through mmap. Only the header is
+    read up front; a machine's record is only looked at when it is asked for,
+    and its arrays are numpy views of the mapped file, so opening a large archive
+    to simulate one machine doesn't parse the others.
+    Examples:
+        save_machines('machines.fsa', [M1, M2, M3])
+        with MachineArchive('machines.fsa') as archive:
+            archive['M2'].accepts('abba')
+            record = archive.record(0)  # the CSR arrays, without building the machine
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: The archive.
+        """
+        import mmap
+        require_numpy()
+        with open(path, 'rb') as archive:
+            self._map = mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._map, dtype='<u4', count=3, offset=4)
+        if self._map[:4] != ARCHIVE_MAGIC:
+            raise ValueError(f"{os.fspath(path)} is not a machine archive.")
+        if int(header[0]) > ARCHIVE_VERSION:
+            raise ValueError(f"{os.fspath(path)} is a version {int(header[0])} archive, "
+                             f"only versions up to {ARCHIVE_VERSION} can be read.")
+        self._offsets = np.frombuffer(self._map, dtype='<u8', count=int(header[1]) + 1, offset=16)
+        self._names: dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __enter__(self) -> 'MachineArchive':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the file. Machines already loaded stay valid, and records still in
+        use keep the file mapped until they are dropped.
+        """
+        self._offsets = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Views of the map are still alive, it is unmapped along with them.
+            pass
+
+    def record(self, which: int) -> MachineRecord:
+        """
+        :param which: The position of the machine in the archive.
+        :return: Its record, as views of the mapped file.
+        """
+        offset = int(self._offsets[which])
+        counts = np.frombuffer(self._map, dtype='<u4', count=10, offset=offset).tolist()
+        nStates, nSymbols, nTrans, nFinals, nStrings, nBytes, name, prefix, nMarked = counts[:9]
+        offset += 40
+        views = []
+        for dtype, count in (('<u4', nStrings + 1), ('u1', nBytes), ('<i4', nStates), ('<i8', nStates),
+                             ('<i4', nSymbols), ('<u4', nStates + 1), ('<u4', nTrans), ('<u4', nTrans),
+                             ('<u4', nFinals), ('<u4', nMarked)):
+            view = np.frombuffer(self._map, dtype=dtype, count=count, offset=offset)
+            views.append(view)
+            offset += view.nbytes + (-view.nbytes % 8)
+        strOffsets, blob = views[0].tolist(), views[1]
+        string = lambda num: blob[strOffsets[num]:strOffsets[num + 1]].tobytes().decode()
+        return MachineRecord(string(name), string(prefix), string, *views[2:])
+
+    def names(self) -> list[str]:
+        """
+        :return: The names of the machines, in order.
+        """
+        return [self.record(num).name for num in range(len(self))]
+
+    def __getitem__(self, which: int | str) -> Machine:
+        """
+        :param which: The position or the name of a machine.
+        :return: The machine.
+        """
+        if isinstance(which, str):
+            if self._names is None:
+                self._names = dict([(name, num) for num, name in reversed(list(enumerate(self.names())))])
+            if which not in self._names:
+                raise KeyError(which)
+            which = self._names[which]
+        return self.record(which).machine()
+
+
+def _render_key(version: bytes, name: str, transitions: transitions_type, accepting: acceptingType = ('f',),
+                auto: Automaton | None = None, passes: passesType = None) -> str:
+    # RenderCache.key, without the cache, so render_many's workers can compute keys.
+    passes = tuple(RENDER_PASSES if passes is None else passes)
+    if auto is None:
+        auto = build_automaton(name, transitions, accepting, passes)
+    digest = hashlib.sha256(version)
+    digest.update(repr((name, transitions, tuple(accepting), TRIM_COMPOSED_ACC_STATES,
+                        MERGE_EQUIVALENT_COLUMNS,
+                        [getattr(stage, '__qualname__', repr(stage)) for stage in passes])).encode())
+    digest.update(repr(pick_template(auto).template).encode())
+    digest.update('\x00'.join([STATES.name(sid) for sid in auto.finals]).encode())
+    names = SYMBOLS.names
+    for src, lab, dst in zip(auto.src, auto.lab, auto.dst):
+        digest.update(f"\n{STATES.name(src)}\x00{names[lab]}\x00{STATES.name(dst)}".encode())
+    return digest.hexdigest()
+
+
+def _render_spec(spec: typing.Sequence, passes: passesType = None) -> str | Exception:
+    # Runs in the worker processes of render_many, so it must be module level.
+    try:
+        return getMachineStr(*spec, passes=passes)
+    except (ValueError, TypeError) as e:
+        return e
+
+
+def _render_spec_keyed(spec: typing.Sequence, passes: passesType, version: bytes, directory: str
+                       ) -> tuple[str | None, str | Exception | None, Machine | None]:
+    # _render_spec for a render_many with a cache: the worker builds the
+    # automaton once, for both the key and the LaTeX, and doesn't render a
+    # machine whose entry is already in the cache directory.
+    # :return: The key, then the LaTeX (None if the entry exists) or the error,
+    #     then the machine getMachine returns.
+    try:
+        name, transitions, *rest = spec
+        accepting = tuple(rest[0]) if rest else ('f',)
+        check_named(name)
+        auto = build_automaton(name, transitions, accepting, passes)
+        key = _render_key(version, name, transitions, accepting, auto, passes)
+        if os.path.exists(os.path.join(directory, key + RenderCache.SUFFIX)):
+            return key, None, None
+        pieces, curMach = _render(name, transitions, auto)
+        return key, ''.join(pieces), curMach
+    except (ValueError, TypeError) as e:
+        return None, e, None
+
+
+def render_many(specs: typing.Iterable[typing.Sequence], workers: int | None = None,
+                chunksize: int | None = None, raiseErrors: bool = True,
+                cache: RenderCache | None = None, passes: passesType = None) -> list[str | Exception]:
+    """
+    Renders many machines (see getMachine) on a pool of processes. The output is
+    in the order of specs and byte for byte what rendering them one by one gives.
+    Examples:
+        document = ''.join(render_many([('a', 'a'), ('b', [(0, 'b', 'f')])], workers=4))
+    :param specs: [name, transitions] or [name, transitions, accepting] entries.
+    :param workers: The number of processes, by default one per CPU. With 1 (or a
+        single spec) the machines are rendered in this process.
+    :param chunksize: How many specs are sent to a worker at a time, by default
+        enough for about four chunks per worker.
+    :param raiseErrors: Whether a bad spec raises its error, otherwise the error
+        is returned in its place.
+    :param cache: Only misses are rendered. The workers compute the keys and skip
+        the machines whose entries exist; the entries are read and written here.
+    :param passes: Run on every machine, see getMachine. They are sent to the
+        workers, so they must be picklable (module level functions or methods).
+    :return: The LaTeX of each machine.
+    """
+    import functools
+    specs = list(specs)
+    passes = tuple(RENDER_PASSES if passes is None else passes)
+    if cache is None:
+        job = functools.partial(_render_spec, passes=passes)
+    else:
+        job = functools.partial(_render_spec_keyed, passes=passes, version=cache._version,
+                                directory=cache.directory)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(specs)))
+    if workers == 1:
+        rendered = [job(spec) for spec in specs]
+    else:
+        import concurrent.futures
+        if chunksize is None:
+            chunksize = max(1, len(specs) // (4 * workers))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(job, specs, chunksize=chunksize))
+    results: list[str | Exception] = rendered
+    if cache is not None:
+        results = []
+        for spec, (key, result, curMach) in zip(specs, rendered):
+            hit = cache.get(key) if key is not None else None
+            if hit is not None:
+                result = hit[0]
+            elif key is not None:
+                if result is None:
+                    # The entry a worker found is gone or unreadable.
+                    latex, curMach = getMachine(*spec, passes=passes)
+                    result = latex
+                cache.put(key, result, curMach)
+            results.append(result)
+    if raiseErrors:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+    return results
 
 
 # Tests
@@ -475,17 +3516,99 @@ def getMachineStr(name: str, transitions: transitions_type) -> str:
 # print(Delta(state('1', 0), 'a', state('1', 'f')))
 # print(Delta(state('1', 0), ['a', epsilonElement], state('1', 1)))
 
-outputStr = ''
+class LatexWriter:
+    """
+    Where rendered machines go. Each machine is written to the target as it is
+    rendered instead of being appended to one big string. A writer may be shared
+    by several threads; every machine is written as a whole.
+    Examples:
+        LatexWriter()                 # In-memory, read it back with getvalue().
+        LatexWriter('machines.tex')   # A file, closed by close().
+        LatexWriter(sys.stdout)       # Any open text stream (left open).
+        LatexWriter(clipboard=True)   # In-memory, copied to the clipboard by close().
+    """
+
+    def __init__(self, target: str | os.PathLike | typing.TextIO | None = None, clipboard: bool = False,
+                 cache: RenderCache | None = None):
+        """
+        :param target: A path, an open text stream, or None for an in-memory buffer.
+        :param clipboard: Whether close() copies everything written to the clipboard.
+        :param cache: The render cache write_machine goes through, if any.
+        """
+        self.clipboard = clipboard
+        self.cache = cache
+        self._owned = False
+        self._lock = threading.Lock()
+        match target:
+            case None:
+                self.out: typing.TextIO = io.StringIO()
+            case str() | os.PathLike():
+                self.out = open(target, 'w', encoding='utf-8')
+                self._owned = True
+            case _:
+                self.out = target
+        if clipboard and not isinstance(self.out, io.StringIO):
+            raise ValueError("Only an in-memory writer can be copied to the clipboard.")
+
+    def write(self, latex: str):
+        with self._lock:
+            self.out.write(latex)
+
+    def write_machine(self, name: str, transitions: transitions_type,
+                      accepting: acceptingType = ('f',), passes: passesType = None) -> Machine:
+        """
+        Renders a machine (see getMachine) straight into the target.
+        :return: The machine as Delta transitions.
+        """
+        (pieces, curMach) = renderMachine(name, transitions, accepting, self.cache, passes)
+        with self._lock:
+            for piece in pieces:
+                self.out.write(piece)
+        return curMach
+
+    def getvalue(self) -> str:
+        """
+        :return: Everything written so far, only for in-memory writers.
+        """
+        return self.out.getvalue()
+
+    def reset(self):
+        """
+        Forgets everything written so far, only for in-memory writers.
+        """
+        with self._lock:
+            self.out.seek(0)
+            self.out.truncate()
+
+    def close(self):
+        if self.clipboard:
+            # Imported here so the module loads on machines without a clipboard.
+            import pyperclip
+            pyperclip.copy(self.getvalue())
+        if self._owned:
+            self.out.close()
+        else:
+            self.out.flush()
+
+    def __enter__(self) -> 'LatexWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# The writer print_mach uses when it isn't given one.
+latexOut = LatexWriter()
 
 
-def print_mach(*mach: getMachineStr.__annotations__, reset: bool = False) -> Machine:
-    global outputStr
+def print_mach(*mach: getMachineStr.__annotations__, reset: bool = False,
+               writer: LatexWriter | None = None) -> Machine:
+    if writer is None:
+        writer = latexOut
     if reset:
-        outputStr = ''
-    (curMach, curDeltas) = getMachine(*mach)
+        writer.reset()
     # print(f"Machine {mach!r}:\n{curMach}\n\n")
-    outputStr += curMach
-    return curDeltas
+    return writer.write_machine(*mach)
 
 
 # Test a bunch of error conditions.
@@ -494,36 +3617,25 @@ testBadMachines = [['a', b'a'],
                    ['b', [(0, 'f')]],
                    ['b', ['a', eps_ele]],
                    ]
-for mach in testBadMachines:
-    try:
-        curMach = getMachineStr(*mach)
-        print(f"ERROR!!! Machine {mach} -> Should have caused an exception, but didn't! Output: {curMach}.",
-              file=sys.stderr)
-    except Exception as e:
-        # print(f"Good catch for machine{mach!r}: {e}")
-        pass
-
-print_mach('a', 'a')
-print_mach('a2a', 'a')
-print_mach('a2b', [(0, 'b', 1), (1, 'c', 'f')])
-print_mach('a2', [(0, eps_ele, state_2('a2a', 0)), (state_2('a2b', 'f'), eps_ele, 'f')])
-
-#  (a + bc)(a + b)*
-# Ma2a = print_mach('a2a', 'b', reset=True)
-# Ma2b = print_mach('a2b', 'c')
-# Ma2 = Ma2a.concat(Ma2b).setName('a2')
-# print_mach(Ma2.name, Ma2.transitions)
-# Ma1 = print_mach('a1', 'a')
-# Ma = (Ma1 + Ma2).setName('a')
-# print_mach(Ma.name, Ma.transitions)
-# Mb1 = print_mach('b1', 'a')
-# Mb2 = print_mach('b2', 'b')
-# Mb = (Mb1 + Mb2).KStar().setName('b')
-# print_mach(Mb.name, Mb.transitions)
-#
-# # Note this is not printed in the stuff.
-# fullM = Ma.concat(Mb).setName('')
-# pyperclip.copy(outputStr)
+
+
+def check_bad_machines() -> bool:
+    """
+    :return: Whether every machine in testBadMachines was rejected.
+    """
+    allCaught = True
+    for mach in testBadMachines:
+        try:
+            curMach = getMachineStr(*mach)
+            print(f"ERROR!!! Machine {mach} -> Should have caused an exception, but didn't! Output: {curMach}.",
+                  file=sys.stderr)
+            allCaught = False
+        except Exception as e:
+            # print(f"Good catch for machine{mach!r}: {e}")
+            pass
+    return allCaught
+
+
 mt6M = Machine('a', [
         (0, ['b','c'], 1),
         (0, ['a'], 0),
@@ -534,5 +3646,128 @@ mt6M = Machine('a', [
         ('f', ['a'], 'f'),
         ('f', ['b','c'], 1),
 ])
-pyperclip.copy(str(mt6M))
-print("Done!\n\n")
\ No newline at end of file
+
+
+def demo(writer: LatexWriter) -> int:
+    """
+    Renders the sample machines into writer.
+    :return: The number of machines written.
+    """
+    samples = [('a', 'a'),
+               ('a2a', 'a'),
+               ('a2b', [(0, 'b', 1), (1, 'c', 'f')]),
+               ('a2', [(0, eps_ele, state_2('a2a', 0)), (state_2('a2b', 'f'), eps_ele, 'f')])]
+    for mach in samples:
+        print_mach(*mach, writer=writer)
+
+    #  (a + bc)(a + b)*
+    # Ma2a = print_mach('a2a', 'b', reset=True)
+    # Ma2b = print_mach('a2b', 'c')
+    # Ma2 = Ma2a.concat(Ma2b).setName('a2')
+    # print_mach(Ma2.name, Ma2.transitions)
+    # Ma1 = print_mach('a1', 'a')
+    # Ma = (Ma1 + Ma2).setName('a')
+    # print_mach(Ma.name, Ma.transitions)
+    # Mb1 = print_mach('b1', 'a')
+    # Mb2 = print_mach('b2', 'b')
+    # Mb = (Mb1 + Mb2).KStar().setName('b')
+    # print_mach(Mb.name, Mb.transitions)
+    #
+    # # Note this is not printed in the stuff.
+    # fullM = Ma.concat(Mb).setName('')
+    writer.write(str(mt6M))
+    return len(samples) + 1
+
+
+def read_specs(path: str) -> list[list]:
+    """
+    Reads a spec file: a JSON list of [name, transitions] or
+    [name, transitions, accepting] entries, like testBadMachines. A transition
+    is a [from, on, to] list and on may itself be a list.
+    :param path: The spec file, '-' for stdin.
+    :return: The entries, ready to pass to getMachine.
+    """
+    import json
+    if path == '-':
+        specs = json.load(sys.stdin)
+    else:
+        with open(path, encoding='utf-8') as specFile:
+            specs = json.load(specFile)
+    if not isinstance(specs, list):
+        raise ValueError(f"{path}: expected a JSON list of [name, transitions] entries.")
+    return specs
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    The command line: python -m FSA [-o OUT | --clipboard] [--demo] [--simplify] [--profile FILE] [SPEC ...]
+    Renders every machine of every spec file into one document, then reports the
+    startup and render times on stderr.
+    :return: The exit status.
+    """
+    import argparse
+    mainStart = time.perf_counter()
+    parser = argparse.ArgumentParser(prog='python -m FSA', description='Render FSA machines as LaTeX.')
+    parser.add_argument('specs', nargs='*', help="JSON spec files of [name, transitions] entries ('-' for stdin).")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('-o', '--output', help='Write the LaTeX here instead of stdout.')
+    target.add_argument('--clipboard', action='store_true', help='Copy the LaTeX to the clipboard instead.')
+    parser.add_argument('--demo', action='store_true', help='Check testBadMachines and render the sample machines.')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Render the spec files on this many processes (0 for one per CPU).')
+    parser.add_argument('--cache', metavar='DIR', help='Reuse machines rendered by earlier runs, kept in DIR.')
+    parser.add_argument('--cache-size', type=float, default=64, metavar='MB',
+                        help='How large the cache may grow (default 64 MB).')
+    parser.add_argument('--simplify', action='store_true',
+                        help='Remove epsilon transitions and useless states before rendering.')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write the time each stage took for each machine here, as JSON '
+                             '(machines rendered by other processes are not included).')
+    args = parser.parse_args(argv)
+    passes = SIMPLIFY_PASSES if args.simplify else None
+
+    cache = RenderCache(args.cache, int(args.cache_size * 1024 * 1024)) if args.cache else None
+    if args.clipboard:
+        writer = LatexWriter(clipboard=True, cache=cache)
+    else:
+        writer = LatexWriter(args.output if args.output else sys.stdout, cache=cache)
+    status = 0
+    count = 0
+    profiler = Profiler() if args.profile else contextlib.nullcontext()
+    renderStart = time.perf_counter()
+    with profiler, writer:
+        if args.demo:
+            if not check_bad_machines():
+                status = 1
+            count += demo(writer)
+        for path in args.specs:
+            specs = read_specs(path)
+            if args.workers == 1:
+                for spec in specs:
+                    try:
+                        writer.write_machine(*spec, passes=passes)
+                        count += 1
+                    except (ValueError, TypeError) as e:
+                        print(f"{path}: machine {spec[0]!r} failed: {e}", file=sys.stderr)
+                        status = 1
+                continue
+            for spec, result in zip(specs, render_many(specs, workers=args.workers or None,
+                                                       raiseErrors=False, cache=cache, passes=passes)):
+                if isinstance(result, Exception):
+                    print(f"{path}: machine {spec[0]!r} failed: {result}", file=sys.stderr)
+                    status = 1
+                else:
+                    writer.write(result)
+                    count += 1
+    renderTime = time.perf_counter() - renderStart
+    if args.profile:
+        profiler.to_json(args.profile)
+    print(f"startup {1000 * (mainStart - _loadStart):.1f} ms, "
+          f"rendered {count} machines in {1000 * renderTime:.1f} ms", file=sys.stderr)
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
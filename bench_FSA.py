@@ -0,0 +1,236 @@
+"""
+Benchmarks for FSA.py.
+
+Machines are generated in families at a range of sizes, and the main stages of
+building and rendering them are timed: composing with +/concat/KStar and
+flattening the result, getMachine, Delta.deltas_to_table and State.sort_list.
+The best of several runs is reported. Timings can be saved as a baseline
+(a JSON file), and later runs are compared with it; a run slower than its
+baseline by more than the tolerance is flagged as a regression and makes the
+exit status 1. Baselines only mean something on the machine they were made on,
+so bench_baseline.json (the default) is ignored by git rather than committed.
+
+Examples:
+    python bench_FSA.py --save-baseline
+    python bench_FSA.py -o bench_output.txt
+    python bench_FSA.py --sizes 10,100,1000,10000,100000 --families chain,cycle
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import typing
+
+import FSA
+from FSA import Delta, Machine, State
+
+ELEMENTS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def chain(n: int) -> Machine:
+    """
+    :return: q0 -a-> q1 -b-> ... -> qf, n states.
+    """
+    return Machine('chain', [(idx, ELEMENTS[idx % 26], idx + 1) for idx in range(n - 2)] +
+                   [(n - 2, ELEMENTS[(n - 2) % 26], 'f')])
+
+
+def cycle(n: int) -> Machine:
+    """
+    :return: mt6M stretched to n states, every state loops on a and moves on
+        'b, c' to the next, qf back to q1.
+    """
+    last = lambda idx: 'f' if idx == n - 1 else idx
+    return Machine('cycle', [delta for idx in range(n)
+                             for delta in ((last(idx), 'a', last(idx)),
+                                           (last(idx), 'b, c', last(idx + 1) if idx < n - 1 else 1))])
+
+
+def wide(n: int) -> Machine:
+    """
+    :return: n states over an alphabet of min(n, 64) elements, four moves out of
+        every state.
+    """
+    k = min(n, 64)
+    rand = random.Random(n)
+    last = lambda idx: 'f' if idx == n - 1 else idx
+    return Machine('wide', [(last(idx), f"x_{rand.randrange(k)}", last(rand.randrange(n)))
+                            for idx in range(n) for _ in range(4)])
+
+
+def tree(n: int, op: str) -> Machine:
+    """
+    A left deep expression of n single element machines (about 2n states with
+    the composition's own). Every sub-machine gets a name of its own, so the
+    states of the parts don't clash.
+    :param op: '+', 'concat' or 'KStar' (concatenations, every fourth one starred).
+    """
+    leaves = [Machine(f"l{num}", ELEMENTS[num % 26]) for num in range(max(1, n // 2))]
+    mach = leaves[0]
+    for num, leaf in enumerate(leaves[1:], 1):
+        match op:
+            case '+':
+                mach = (mach + leaf).setName(f"t{num}")
+            case 'concat':
+                mach = mach.concat(leaf).setName(f"t{num}")
+            case 'KStar':
+                mach = mach.concat(leaf.KStar().setName(f"s{num}") if num % 4 == 0 else leaf).setName(f"t{num}")
+    return mach.setName('tree')
+
+
+FAMILIES: dict[str, typing.Callable[[int], Machine]] = {
+    'chain': chain,
+    'cycle': cycle,
+    'wide': wide,
+    'union': lambda n: tree(n, '+'),
+    'concat': lambda n: tree(n, 'concat'),
+    'kstar': lambda n: tree(n, 'KStar'),
+}
+COMPOSED = ('union', 'concat', 'kstar')
+
+OPS = ('compose', 'flatten', 'getMachine', 'deltas_to_table', 'sort_list')
+
+
+def measure(func: typing.Callable[[], typing.Any], repeat: int, minTime: float) -> float:
+    """
+    :param func: What to time.
+    :param repeat: How many runs to take the best of.
+    :param minTime: Fast functions are run in loops lasting at least this long.
+    :return: The best time of one call, in seconds.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        taken = time.perf_counter() - start
+        if taken >= minTime or loops >= 1 << 20:
+            break
+        loops *= 10 if taken < minTime / 10 else 2
+    best = taken / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def bench(family: str, n: int, ops: typing.Sequence[str], repeat: int,
+          minTime: float) -> dict[str, float]:
+    """
+    Times the ops on the family's machine of size n.
+    :return: op -> seconds, for the ops that apply to the family.
+    """
+    build = FAMILIES[family]
+    results = dict()
+    if 'compose' in ops and family in COMPOSED:
+        results['compose'] = measure(lambda: build(n), repeat, minTime)
+    mach = build(n)
+    if 'flatten' in ops:
+        # A machine whose automaton isn't cached yet, on every run.
+        results['flatten'] = measure(lambda: Machine(mach.name, mach.transitions, mach.accepting).automaton(),
+                                     repeat, minTime)
+    if 'getMachine' in ops:
+        results['getMachine'] = measure(lambda: FSA.getMachine(mach.name, mach.transitions, mach.accepting),
+                                        repeat, minTime)
+    auto = mach.automaton()
+    if 'deltas_to_table' in ops:
+        deltas = auto.to_deltas()
+        results['deltas_to_table'] = measure(lambda: Delta.deltas_to_table(deltas, auto.prefix), repeat, minTime)
+    if 'sort_list' in ops:
+        names = [FSA.STATES.name(sid) for sid in auto.states]
+        random.Random(n).shuffle(names)
+        results['sort_list'] = measure(lambda: State.sort_list(names), repeat, minTime)
+    return results
+
+
+def compare(timings: dict[str, float], baseline: dict[str, float], tolerance: float,
+            floor: float) -> list[str]:
+    """
+    :param tolerance: How much slower than its baseline a run may be (0.25 is 25%).
+    :param floor: Differences below this many seconds are noise, never regressions.
+    :return: The keys of the regressed timings.
+    """
+    return [key for key, taken in timings.items()
+            if key in baseline and taken > baseline[key] * (1 + tolerance) and taken - baseline[key] > floor]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    :return: The exit status, 1 when a regression was found.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark FSA.py.')
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='Comma separated machine sizes (states), up to 100000.')
+    parser.add_argument('--families', default=','.join(FAMILIES), help='Comma separated families.')
+    parser.add_argument('--ops', default=','.join(OPS), help='Comma separated stages to time.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs to take the best of.')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='Fast stages are looped for at least this many seconds per run.')
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'bench_baseline.json'),
+                        help='The baseline file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline (local to this machine, not committed).')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Flag runs this much slower than the baseline (default 0.25 = 25%%).')
+    parser.add_argument('--floor', type=float, default=0.0005,
+                        help='Ignore differences below this many seconds.')
+    parser.add_argument('-o', '--output', help='Also write the report here (e.g. bench_output.txt).')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    families = args.families.split(',')
+    ops = args.ops.split(',')
+    for family in families:
+        if family not in FAMILIES:
+            parser.error(f"Unknown family {family!r}, choose from {', '.join(FAMILIES)}.")
+    for op in ops:
+        if op not in OPS:
+            parser.error(f"Unknown op {op!r}, choose from {', '.join(OPS)}.")
+
+    baseline = dict()
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as src:
+            baseline = json.load(src)['timings']
+
+    lines = [f"{'family':<8} {'op':<16} {'size':>7} {'ms':>11} {'baseline':>11} {'ratio':>6}"]
+    print(lines[0], flush=True)
+    timings = dict()
+    for family in families:
+        for n in sizes:
+            for op, taken in bench(family, n, ops, args.repeat, args.min_time).items():
+                key = f"{family}/{op}/{n}"
+                timings[key] = taken
+                base = baseline.get(key)
+                flag = ' REGRESSION' if compare({key: taken}, baseline, args.tolerance, args.floor) else ''
+                line = (f"{family:<8} {op:<16} {n:>7} {1000 * taken:>11.3f} " +
+                        (f"{1000 * base:>11.3f} {taken / base:>6.2f}" if base else f"{'-':>11} {'-':>6}") + flag)
+                lines.append(line)
+                print(line, flush=True)
+
+    regressions = compare(timings, baseline, args.tolerance, args.floor)
+    summary = (f"{len(regressions)} regressions against {args.baseline}" if baseline else
+               f"no baseline at {args.baseline}" if not args.save_baseline else f"baseline saved to {args.baseline}")
+    lines.append(summary)
+    print(summary)
+    if args.save_baseline:
+        stored = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as src:
+                stored = json.load(src)['timings']
+        stored.update(timings)
+        with open(args.baseline, 'w') as dst:
+            json.dump(dict(python=sys.version.split()[0], platform=platform.platform(), timings=stored),
+                      dst, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as dst:
+            dst.write('\n'.join(lines) + '\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
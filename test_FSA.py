@@ -0,0 +1,483 @@
+"""
+Regression tests for FSA.py. Languages are checked against brute force: the
+words up to a small length an expression stands for are enumerated (or matched
+with Python's re) and compared with what the machine accepts.
+
+    python -m pytest -q test_FSA.py
+"""
+import ast
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+
+import pytest
+
+import FSA
+from FSA import Machine
+
+MAX_LEN = 6
+
+
+def words(alphabet: str, maxLen: int = MAX_LEN) -> list[str]:
+    """
+    :return: Every word over alphabet of length up to maxLen.
+    """
+    return [''.join(word) for size in range(maxLen + 1) for word in itertools.product(alphabet, repeat=size)]
+
+
+def concat_words(left: set[str], right: set[str]) -> set[str]:
+    return set([lWord + rWord for lWord in left for rWord in right if len(lWord) + len(rWord) <= MAX_LEN])
+
+
+def star_words(inner: set[str]) -> set[str]:
+    result = {''}
+    while True:
+        grown = result | concat_words(result, inner)
+        if grown == result:
+            return result
+        result = grown
+
+
+def random_composition(rand: random.Random, depth: int) -> tuple[Machine, set[str]]:
+    """
+    :return: A machine composed with +, concat and KStar out of single element
+        machines over 'ab', and the words up to MAX_LEN it should accept.
+    """
+    name = lambda kind: f"{kind}{rand.randrange(10 ** 9)}"
+    pick = rand.random()
+    if depth == 0 or pick < 0.3:
+        ele = rand.choice('ab')
+        return Machine(name('l'), ele), {ele}
+    if pick < 0.55:
+        (left, lWords), (right, rWords) = random_composition(rand, depth - 1), random_composition(rand, depth - 1)
+        return (left + right).setName(name('u')), lWords | rWords
+    if pick < 0.8:
+        (left, lWords), (right, rWords) = random_composition(rand, depth - 1), random_composition(rand, depth - 1)
+        return left.concat(right).setName(name('c')), concat_words(lWords, rWords)
+    inner, iWords = random_composition(rand, depth - 1)
+    return inner.KStar().setName(name('s')), star_words(iWords)
+
+
+def random_regex(rand: random.Random, depth: int) -> tuple[str, set[str]]:
+    """
+    :return: A regular expression over 'ab' for Machine.from_regex, and the words
+        up to MAX_LEN it stands for.
+    """
+    pick = rand.random()
+    if depth == 0 or pick < 0.3:
+        ele = rand.choice('ab')
+        return ele, {ele}
+    if pick < 0.55:
+        (left, lWords), (right, rWords) = random_regex(rand, depth - 1), random_regex(rand, depth - 1)
+        return f"({left}+{right})", lWords | rWords
+    if pick < 0.8:
+        (left, lWords), (right, rWords) = random_regex(rand, depth - 1), random_regex(rand, depth - 1)
+        return f"{left}{right}", concat_words(lWords, rWords)
+    inner, iWords = random_regex(rand, depth - 1)
+    return f"({inner})*", star_words(iWords)
+
+
+def accepts(mach: Machine, word: str) -> bool:
+    """
+    Runs the ε-NFA of mach on word, straight from its automaton.
+    """
+    auto = mach.automaton()
+    eps = FSA.SYMBOLS.intern(FSA.eps_ele)
+    moves: dict[int, list[tuple[int, int]]] = dict()
+    for src, lab, dst in zip(auto.src, auto.lab, auto.dst):
+        moves.setdefault(src, list()).append((lab, dst))
+
+    def closure(current: set[int]) -> set[int]:
+        work = list(current)
+        while work:
+            for lab, dst in moves.get(work.pop(), ()):
+                if lab == eps and dst not in current:
+                    current.add(dst)
+                    work.append(dst)
+        return current
+
+    current = closure({auto.start})
+    for ele in word:
+        current = closure(set([dst for sid in current for lab, dst in moves.get(sid, ())
+                               if ele in [FSA.SYMBOLS.names[part] for part in FSA.SYMBOLS.parts[lab]]]))
+    return not current.isdisjoint(auto.finals)
+
+
+def assert_language(mach: Machine, expected: str | set[str], alphabet: str = 'ab'):
+    """
+    :param expected: A Python regular expression, or the words up to MAX_LEN.
+    """
+    for word in words(alphabet):
+        inside = word in expected if isinstance(expected, set) else bool(re.fullmatch(expected, word))
+        assert accepts(mach, word) == inside, (expected, word)
+        assert mach.accepts(word) == inside, (expected, word)
+
+
+def test_kstar_with_moves_into_start_and_out_of_final():
+    # mt6M's q0 loops on a and its q_f has moves out, (a*b)* has the same.
+    assert not accepts(FSA.mt6M.KStar(), 'a')
+    assert_language(FSA.mt6M.KStar(), r"(a*[bc]a*[bc]a*[bc](a|[bc]a*[bc]a*[bc])*)*", 'abc')
+    loop = Machine('m', [(0, 'a', 0), (0, 'b', 'f')])
+    assert not accepts(loop.KStar(), 'a')
+    assert_language(loop.KStar(), r"(a*b)*")
+    # An unnamed operand is named after the star, its states don't clash.
+    both = (Machine('b1', 'a') + Machine('b2', 'b')).KStar().setName('b')
+    assert_language(both.concat((Machine('c1', 'a') + Machine('c2', 'b')).KStar().setName('c')), r"[ab]*")
+
+
+def test_compositions():
+    rand = random.Random(3)
+    for _ in range(100):
+        mach, expected = random_composition(rand, 4)
+        assert_language(mach, expected)
+
+
+def test_from_regex():
+    rand = random.Random(5)
+    for _ in range(200):
+        regex, expected = random_regex(rand, 5)
+        assert_language(Machine.from_regex(regex, 'M'), expected)
+
+
+def test_deep_regex():
+    # Nesting far past the recursion limit parses, prints and builds, and the
+    # state suffixes stay short.
+    depth = 5000
+    mach = Machine.from_regex('(a+' * depth + 'b' + ')*' * depth, 'M')
+    assert mach.accepts('b') and mach.accepts('aab') and not mach.accepts('c')
+    assert str(FSA.Regex.parse(str(mach.transitions))).count('+') == depth
+    states = mach.automaton().states
+    assert max([len(FSA.STATES.prefixes[sid]) for sid in states]) <= len('M') + len(str(len(states)))
+    for regex in ('a(' * depth + 'b' + ')' * depth, '(' * depth + 'a' + ')*b' * depth):
+        assert len(Machine.from_regex(regex, 'N').automaton()) > depth
+    with pytest.raises(ValueError, match="Missing"):
+        FSA.Regex.parse('(' * depth + 'a')
+
+
+def test_determinize():
+    rand = random.Random(9)
+    for _ in range(100):
+        regex, expected = random_regex(rand, 5)
+        dfa = Machine.from_regex(regex, 'M').determinize()
+        assert_language(dfa, expected)
+        auto = dfa.automaton()
+        moves = [(src, lab) for src, lab in zip(auto.src, auto.lab)]
+        assert len(set(moves)) == len(moves) and FSA.EPS not in auto.lab
+
+
+def test_minimize():
+    # The accepting block used to be refined in place through an alias of the
+    # accepting states, which gave a wrong language for about a quarter of these.
+    rand = random.Random(5)
+    for _ in range(200):
+        regex, expected = random_regex(rand, 5)
+        minimal = Machine.from_regex(regex, 'M').minimize()
+        assert_language(minimal, expected)
+        assert minimal.automaton().is_deterministic()
+        assert len(minimal.minimize().automaton().states) == len(minimal.automaton().states)
+
+
+def test_products():
+    # intersect, difference and complement against the brute force languages.
+    rand = random.Random(17)
+    for _ in range(100):
+        (left, lWords), (right, rWords) = random_regex(rand, 4), random_regex(rand, 4)
+        lMach, rMach = Machine.from_regex(left, 'L'), Machine.from_regex(right, 'R')
+        assert_language(lMach.intersect(rMach), lWords & rWords)
+        assert_language(lMach.difference(rMach), lWords - rWords)
+        assert_language(lMach.complement('ab'), set(words('ab')) - lWords)
+    # An empty product still has q0 in Q, and renders like any machine.
+    empty = Machine.from_regex('a*', 'A').intersect(Machine.from_regex('b*', 'B')).setName('P')
+    assert_language(empty, {''})
+    latex = str(empty)
+    assert f"\\s{{{FSA.state('P', 0)}}}" in latex and 'Q_{P} = \\s{}' not in latex
+    for nothing in (Machine.from_regex('a', 'A').difference(Machine.from_regex('a+b', 'B')),
+                    Machine.from_regex('(a+b)*', 'A').complement()):
+        assert_language(nothing, set())
+
+
+def test_equivalent():
+    # Random pairs, and pairs written differently with the same language. A
+    # counterexample must be the shortlex first word the languages differ on.
+    rand = random.Random(19)
+    for _ in range(150):
+        (left, lWords), (right, rWords) = random_regex(rand, 4), random_regex(rand, 4)
+        if rand.random() < 0.3:
+            left, right = f"({left})*", f"({left}+{left})*"
+            lWords = rWords = star_words(lWords)
+        lMach, rMach = Machine.from_regex(left, 'L'), Machine.from_regex(right, 'R')
+        result = lMach.equivalent(rMach)
+        differ = sorted(lWords ^ rWords, key=lambda word: (len(word), word))
+        if differ:
+            assert not result and result.counterexample == differ[0], (left, right)
+        elif not result:
+            word = result.counterexample
+            assert len(word) > MAX_LEN and accepts(lMach, word) != accepts(rMach, word)
+        assert bool(lMach.equivalent(rMach.minimize())) == bool(result)
+        assert lMach.determinize().equivalent(lMach)
+
+
+def test_simplify_passes():
+    # trim and remove_epsilons keep the language, the result has no ε moves and
+    # every state left is on a path from q0 to an accepting state.
+    rand = random.Random(13)
+    for _ in range(100):
+        regex, expected = random_regex(rand, 5)
+        mach = Machine.from_regex(regex, 'M')
+        assert_language(mach.trim(), expected)
+        simple = mach.remove_epsilons()
+        assert_language(simple, expected)
+        auto = simple.automaton()
+        assert FSA.EPS not in auto.lab
+        assert len(auto.trim().states) == len(auto.states)
+
+
+def test_representation_records_compositions():
+    # The $representation comment of a composition lists its transitions, so
+    # rendering them again gives the same machine.
+    comment = re.compile(r"% - (.*) - \n")
+    a2 = Machine('a2a', 'b').concat(Machine('a2b', 'c')).setName('a2')
+    for mach in (a2, (Machine('a1', 'a') + a2).setName('a'), Machine.from_regex('(a+bc)(a+b)*', 'R')):
+        latex = str(mach)
+        again = FSA.getMachineStr(*ast.literal_eval(comment.search(latex).group(1)))
+        assert comment.sub('', latex) == comment.sub('', again)
+
+
+def test_count_and_iter_words():
+    # Both against the brute force languages: iter_words in shortlex order,
+    # count_words of every length up to MAX_LEN, exactly and up to it.
+    rand = random.Random(23)
+    shortlex = lambda word: (len(word), word)
+    for _ in range(100):
+        regex, expected = random_regex(rand, 5)
+        mach = Machine.from_regex(regex, 'M')
+        assert list(mach.iter_words(MAX_LEN)) == sorted(expected, key=shortlex)
+        for n in range(MAX_LEN + 1):
+            assert mach.count_words(n) == len([word for word in expected if len(word) <= n])
+            assert mach.count_words(n, exact=True) == len([word for word in expected if len(word) == n])
+    # Words with multi-character elements are tuples of elements.
+    words3 = list(Machine.from_regex('\\sigma(a+\\tau)*', 'T').iter_words(2))
+    assert words3 == [('\\sigma',), ('\\sigma', '\\tau'), ('\\sigma', 'a')]
+    ids = list(Machine.from_regex('a(b+c)*', 'M').automaton().iter_words(2))
+    assert [''.join([FSA.SYMBOLS.names[ele] for ele in word]) for word in ids] == ['a', 'ab', 'ac']
+    assert Machine.from_regex('(a+b)*', 'M').count_words(300, exact=True) == 2 ** 300
+    assert Machine.from_regex('(a+b)*', 'M').count_words(300) == 2 ** 301 - 1
+
+
+def test_accepts_many():
+    # accepts_many runs an NFA on a subset DFA it builds as it goes, reused by
+    # later batches; it has to agree with accepts word by word.
+    pytest.importorskip('numpy')
+    rand = random.Random(7)
+    batch = words('abc', 4)
+    for _ in range(50):
+        regex, _ = random_regex(rand, 4)
+        sim = Machine.from_regex(regex, 'M').automaton().simulation()
+        for run in (batch, batch[::-1]):
+            assert list(sim.accepts_many(run)) == [sim.accepts(word) for word in run], regex
+
+
+def test_edits_render_like_a_fresh_machine():
+    # The edit methods keep the automaton's views and rendered lines up to date
+    # instead of rebuilding them; printing has to give what rendering the edited
+    # transition list from scratch gives, across δ table pieces too.
+    rand = random.Random(11)
+    for merge in (False, True):
+        FSA.MERGE_EQUIVALENT_COLUMNS = merge
+        try:
+            mach = Machine('E', [(num, 'ab'[num % 2], num + 1) for num in range(1100)] + [(1, 'b, c', 'f')])
+            pool = [0, 1, 2, 3, 'f', 1023, 1024, 1100, FSA.state_2('X', 'f'), FSA.state('X', 1)]
+            for _ in range(50):
+                pick = rand.random()
+                if pick < 0.6:
+                    mach.add_transition(rand.choice(pool), rand.choice(['a', 'b', 'b, c', 'd', FSA.eps_ele]),
+                                        rand.choice(pool))
+                elif pick < 0.9:
+                    mach.remove_transition(*rand.choice(mach.transitions))
+                else:
+                    seen = mach.automaton()._seen
+                    olds = [old for old in (1, 2, 'f', 1023) if FSA.state_id(FSA.idx_2('E'), old) in seen]
+                    new = rand.randrange(2000, 2100)
+                    if olds and FSA.state_id(FSA.idx_2('E'), new) not in seen:
+                        mach.rename_state(rand.choice(olds), new)
+                assert str(mach) == FSA.getMachineStr(mach.name, list(mach.transitions), mach.accepting)
+        finally:
+            FSA.MERGE_EQUIVALENT_COLUMNS = False
+
+
+def test_in_place_changes_are_noticed():
+    # Changing the transition or accepting lists in place, rather than through
+    # the edit methods or by assignment, must not leave a stale automaton behind.
+    mach = Machine('P', [(0, 'a', 'f')])
+    assert mach.accepts('a') and not mach.accepts('b')
+    str(mach)
+    mach.transitions.append((0, 'b', 'f'))
+    assert mach.accepts('b')
+    assert str(mach) == FSA.getMachineStr('P', list(mach.transitions))
+    mach.transitions[0] = (0, 'c', 'f')
+    assert mach.accepts('c') and not mach.accepts('a')
+    mach.accepting = [0]
+    mach.accepting.append('f')
+    assert mach.accepts('') and mach.accepts('c')
+    # After the edit methods, a change behind their back is noticed too.
+    mach.add_transition(0, 'd', 'f')
+    mach.transitions.append((0, 'e', 'f'))
+    assert mach.accepts('e') and mach.accepts('d')
+    assert str(mach) == FSA.getMachineStr('P', list(mach.transitions), mach.accepting)
+
+
+def test_render_cache(tmp_path):
+    # A hit gives the LaTeX and machine a miss rendered; entries are evicted least
+    # recently used first, and an entry that doesn't decode is a miss.
+    specs = [('c1', [(0, 'a', 1), (1, 'b', 'f')]),
+             ('c2', (Machine('x', 'a') + Machine('y', 'b')).KStar().transitions),
+             ('c3', [(0, 'a', FSA.state_2('z', 'f')), (FSA.state_2('z', 'f') + ' ', 'b', 'f')]),
+             ('c4', [(0, 'a', 1), (1, 'b', 2)], [1, 2])]
+    cache = FSA.RenderCache(tmp_path)
+    missed = [FSA.getMachine(*spec, cache=cache) for spec in specs]
+    assert (cache.hits, cache.misses) == (0, len(specs))
+    hit = [FSA.getMachine(*spec, cache=cache) for spec in specs]
+    assert (cache.hits, cache.misses) == (len(specs), len(specs))
+    for (mLatex, mMach), (hLatex, hMach) in zip(missed, hit):
+        assert hLatex == mLatex == FSA.getMachineStr(mMach.name, *[spec for spec in specs
+                                                                   if spec[0] == mMach.name][0][1:])
+        assert (hMach.name, hMach.transitions, list(hMach.accepting)) == \
+               (mMach.name, mMach.transitions, list(mMach.accepting))
+    # A fresh cache over the same directory hits too.
+    assert FSA.getMachine(*specs[0], cache=FSA.RenderCache(tmp_path))[0] == missed[0][0]
+
+    # Corrupted entries: not JSON, JSON of the wrong shape, truncated.
+    for num, junk in enumerate([b'\x80\x04not json', b'{"name": "c1", "latex": 5}', b'{"name": "c1", "lat']):
+        key = cache.key(*specs[0])
+        with open(cache.path(key), 'wb') as entry:
+            entry.write(junk)
+        misses = cache.misses
+        assert FSA.getMachine(*specs[0], cache=cache)[0] == missed[0][0]
+        assert cache.misses == misses + 1
+        assert FSA.getMachine(*specs[0], cache=cache)[0] == missed[0][0]
+        assert cache.misses == misses + 1
+
+    # No room for the third entry: the least recently used one goes.
+    sizes = [os.path.getsize(cache.path(cache.key(*spec))) for spec in specs[:3]]
+    small = FSA.RenderCache(tmp_path / 'small', maxBytes=sum(sizes) - 1)
+    for spec in specs[:2]:
+        FSA.getMachine(*spec, cache=small)
+    FSA.getMachine(*specs[0], cache=small)
+    FSA.getMachine(*specs[2], cache=small)
+    assert small.evictions == 1
+    assert not os.path.exists(small.path(small.key(*specs[1])))
+    assert os.path.exists(small.path(small.key(*specs[0])))
+    assert sum([os.path.getsize(small.path(key)) for key in small._sizes]) <= small.maxBytes
+
+
+def test_reset_interning():
+    # Machines built before a reset render and simulate as before it, and the
+    # tables only hold what was interned since.
+    edited = Machine('R', [(0, 'a', 1), (1, 'b', 'f')])
+    edited.add_transition(1, 'c', 'f')
+    regex = Machine.from_regex('(a+bc)*d', 'X')
+    machines = [edited, regex, (regex + Machine('y', 'b')).KStar().setName('Y'),
+                Machine('Z', [(0, 'a', 1), (1, 'b', 2)], [2]).determinize()]
+    before = [(str(mach), [mach.accepts(word) for word in words('abcd', 4)]) for mach in machines]
+    FSA.reset_interning()
+    assert len(FSA.STATES) == 0 and FSA.SYMBOLS.names == [FSA.eps_ele]
+    assert [(str(mach), [mach.accepts(word) for word in words('abcd', 4)]) for mach in machines] == before
+    assert str(Machine.from_regex('(a+bc)*d', 'X')) == before[1][0]
+    edited.remove_transition(1, 'c', 'f')
+    assert str(edited) == FSA.getMachineStr('R', [(0, 'a', 1), (1, 'b', 'f')])
+
+
+def test_archive_round_trip(tmp_path):
+    # Loaded machines have the same language, states and rendering as the
+    # flattened originals: opaque states, a q_f marked \ACC, accepting states
+    # other than q_f, compositions and regular expressions. Records group the
+    # transitions by state, so only the representation comments' order differs.
+    comment = re.compile(r"% - (.*) - \n")
+    render = lambda mach: (comment.sub('', str(mach)), sorted(map(repr, mach.transitions)))
+    machines = [Machine('o', [(0, 'x', 'opaque'), ('opaque', 'y', 'f'), ('opaque', 'y, z', 'opaque')]),
+                Machine('m', [(0, FSA.eps_ele, FSA.state('m1', 'f')), (FSA.state('m1', 'f'), 'a', 'f')]),
+                Machine('k', [(0, 'a', 1), (1, 'b', 2), (2, 'a', 1)], [1, 2]),
+                FSA.mt6M, (Machine('u1', 'a') + Machine('u2', 'b')).KStar().setName('u'),
+                Machine.from_regex('(a+bc)*a', 'r')]
+    assert machines[1].automaton().marked
+    path = tmp_path / 'machines.fsa'
+    FSA.save_machines(path, machines)
+    with FSA.MachineArchive(path) as archive:
+        assert len(archive) == len(machines) and archive.names() == [mach.name for mach in machines]
+        for num, mach in enumerate(machines):
+            flat = mach.automaton().to_machine(mach.name)
+            for loaded in (archive[num], archive[mach.name], Machine.load(path, num), Machine.load(path, mach.name)):
+                assert loaded.equivalent(mach)
+                assert loaded.automaton().marked == flat.automaton().marked
+                assert render(loaded) == render(flat)
+                assert [loaded.accepts(word) for word in words('abxyz', 3)] == \
+                       [mach.accepts(word) for word in words('abxyz', 3)]
+            record = archive.record(num)
+            assert record.name == mach.name and len(record.dst) == len(mach.automaton())
+        with pytest.raises(KeyError):
+            archive['missing']
+    machines[2].save(path)
+    assert render(Machine.load(path)) == render(machines[2].automaton().to_machine('k'))
+    data = bytearray(path.read_bytes())
+    data[4:8] = (FSA.ARCHIVE_VERSION + 1).to_bytes(4, 'little')
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='version'):
+        Machine.load(path)
+    path.write_bytes(b'nope' + bytes(data[4:]))
+    with pytest.raises(ValueError, match='not a machine archive'):
+        Machine.load(path)
+
+
+def test_profiler_stages():
+    # Every stage is recorded once per render, with keptBlocks only when asked for.
+    for keptBlocks in (True, False):
+        seen = []
+        with FSA.Profiler(lambda *record: seen.append(record), keptBlocks=keptBlocks) as prof:
+            FSA.getMachineStr('p', [(num, 'a', num + 1) for num in range(8)] + [(8, 'b', 'f')])
+        stages = prof.summary()['stages']
+        assert sorted(stages) == sorted(FSA.Profiler.STAGES)
+        assert all([entry['calls'] == 1 for entry in stages.values()]) and len(seen) == len(stages)
+        if not keptBlocks:
+            assert all([entry['keptBlocks'] == 0 for entry in stages.values()])
+
+
+def test_render_many_with_cache(tmp_path):
+    # The workers compute the keys; the output is what rendering one by one
+    # gives, and a second run is all hits.
+    specs = [(f"r{num}", [(step, 'ab'[step % 2], step + 1) for step in range(num)] + [(num, 'c', 'f')])
+             for num in range(12)] + [('bad', [(0, 'a')]), ('r3', [(0, 'a', 1), (1, 'c', 'f')])]
+    expected = [FSA._render_spec(spec) for spec in specs]
+    for workers in (1, 2):
+        cache = FSA.RenderCache(tmp_path / str(workers))
+        for run in range(2):
+            results = FSA.render_many(specs, workers=workers, raiseErrors=False, cache=cache)
+            assert [str(result) for result in results] == [str(result) for result in expected]
+            assert isinstance(results[-2], ValueError)
+        assert (cache.hits, cache.misses) == (len(specs) - 1, len(specs) - 1)
+    with pytest.raises(ValueError):
+        FSA.render_many(specs, workers=2, cache=cache)
+
+
+def test_cli_reports_bad_entries(tmp_path, capsys):
+    # The good machine is written, the bad ones are reported on stderr, and the
+    # exit status is 1.
+    spec = tmp_path / 'spec.json'
+    spec.write_text(json.dumps([['good', [[0, 'a', 1], [1, ['b', 'c'], 'f']]],
+                                ['Undefined', 'a'],
+                                ['bad', [[0, 'a']]]]))
+    good = FSA.getMachineStr('good', [(0, 'a', 1), (1, ['b', 'c'], 'f')])
+    for workers in ('1', '2'):
+        out = tmp_path / f"out{workers}.tex"
+        assert FSA.main([str(spec), '-o', str(out), '-j', workers]) == 1
+        assert out.read_text() == good
+        err = capsys.readouterr().err
+        assert "machine 'Undefined' failed: A composed machine must be named with setName" in err
+        assert "machine 'bad' failed" in err and "machine 'good'" not in err
+        assert 'rendered 1 machines' in err
+    run = subprocess.run([sys.executable, '-m', 'FSA', str(spec)], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(FSA.__file__)))
+    assert run.returncode == 1 and run.stdout == good